@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the results of `utils.run_seed`, keyed by the data,
+the preprocessing config, the learner, its hyperparameters and the random
+seed, so that configs evaluated in earlier runs are not trained again.
+
+Results are stored in an SQLite file shared by all processes; the least
+recently used results are evicted once the stored results exceed the size
+limit.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing, contextmanager
+
+
+LOGGER = logging.getLogger('main.cache')
+
+# preprocessing settings that do not affect the result of a seed
+RUNTIME_SETTINGS = ['n_jobs', 'seed_n_jobs', 'seed_executor', 'random_state',
+                    'num_random_seeds', 'racing', 'racing_min_seeds',
+                    'racing_confidence', 'degenerate_exit', 'max_nan_fraction',
+                    'search', 'halving_eta', 'halving_rungs',
+                    'halving_resource', 'tpe_max_evals', 'tpe_max_time',
+                    'time_budget', 'cache_file', 'cache_max_mb',
+                    'chunksize', 'bundle_time', 'executor',
+                    'concurrent_searches', 'longest_first', 'keep_top_k',
+                    'thread_budget', 'n_cores', 'tpe_startup', 'tpe_gamma',
+                    'tpe_candidates']
+
+# the version of the cached results, changed when the results of a seed
+# change: version 2 seeds LinearSVR, whose results were not reproducible
+VERSION = 2
+
+
+def get_key(data, c, mode, seed):
+    """Return the cache key of a seed of a learner config
+    :param c: learner config
+    :param mode: 'test' or 'val'
+    """
+    pc = sorted((k, v) for k, v in c.pc.items() if k not in RUNTIME_SETTINGS)
+    key = repr([VERSION, data.fingerprint(), c.learner, sorted(c.vals.items()), pc,
+                mode, seed])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, path, max_mb=1024):
+        """
+        :param path: the SQLite file
+        :param max_mb: the size limit of stored results, in megabytes
+        """
+        self.path = path
+        self.max_bytes = max_mb * 2**20
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA auto_vacuum = FULL")
+            conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT "
+                         "PRIMARY KEY, value BLOB, size INTEGER, "
+                         "last_used REAL)")
+
+    @contextmanager
+    def connect(self):
+        """A connection in a transaction, closed afterwards; one per
+        operation, as the cache is used from pool threads and processes
+        """
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn:
+            with conn:
+                yield conn
+
+    def get(self, key):
+        """Return the cached result or None
+        """
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM results WHERE key = ?",
+                               (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?",
+                         (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                         (key, value, len(value), time.time()))
+            self.evict(conn)
+
+    def evict(self, conn):
+        """Delete the least recently used results over the size limit
+        """
+        total = conn.execute("SELECT SUM(size) FROM results").fetchone()[0]
+        excess = (total or 0) - self.max_bytes
+        if excess <= 0:
+            return
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM results "
+                                      "ORDER BY last_used"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM results WHERE key = ?", keys)
+        LOGGER.debug("Evicted %d cached results" % len(keys))
+
+
+# result caches opened in this process, by file
+CACHES = {}
+
+
+def get_cache(pc):
+    """Return the result cache configured in the preprocessing config, or
+    None if caching is off
+    """
+    path = pc.get('cache_file')
+    if not path:
+        return None
+    if path not in CACHES:
+        CACHES[path] = ResultCache(path, pc.get('cache_max_mb', 1024))
+    return CACHES[path]
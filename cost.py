@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Estimates of the runtime of configs, used to schedule the most expensive
+configs first, so that a few large jobs do not end up running alone at the
+end of a search while the other workers are idle, and to bundle cheap configs
+into one job for distributed workers.
+"""
+
+import logging
+import itertools
+import numbers
+import threading
+
+import numpy as np
+
+
+LOGGER = logging.getLogger('main.cost')
+
+# heuristic exponents of the learner settings in the runtime, e.g. the
+# runtime of GB is roughly proportional to n_estimators * max_depth
+PRIOR_EXPONENTS = {
+        "n_estimators": 1.,
+        "max_depth": 1.,
+        "max_features": 1.,
+        "epochs": 1.,
+        "topology": 1.,
+        "batch_size": -1.,
+        "degree": 1.,
+        }
+# the weight of the heuristic exponents against the observed runtimes
+PRIOR_WEIGHT = 1.0
+# runtimes below this are e.g. cache hits and say nothing about the cost
+MIN_RUNTIME = 1e-3
+
+
+def get_size(value):
+    """Return a setting as a positive number, or None
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, numbers.Number):
+        return value if value > 0 else None
+    if isinstance(value, (tuple, list)):
+        sizes = [get_size(x) for x in value]
+        total = sum(x for x in sizes if x is not None)
+        return total if total > 0 else None
+    return None
+
+
+class CostModel:
+
+    def __init__(self):
+        """A log-linear model of the runtime of one random seed of a config:
+        log(runtime) is a linear function of the logs of the settings and
+        of the size of the training data. It starts from the exponents in
+        `PRIOR_EXPONENTS` and is refined with every observed runtime.
+        """
+        self.keys = None
+        self.prior = None
+        self.weights = None
+        self.X = []
+        self.y = []
+        # searches of the same learner may run in several threads
+        self.lock = threading.Lock()
+
+    def get_features(self, vals, data):
+        if self.keys is None:
+            self.keys = sorted(vals)
+            # intercept, data size, then the settings
+            self.prior = np.array([0., 1.] + [PRIOR_EXPONENTS.get(k, 0.)
+                                              for k in self.keys])
+            self.weights = self.prior.copy()
+        x = [1., np.log(max(data.trainX.size, 1))]
+        for k in self.keys:
+            size = get_size(vals.get(k))
+            x.append(np.log(size) if size is not None else 0.)
+        return np.array(x)
+
+    def estimate(self, vals, data):
+        """Return the estimated runtime of one seed in seconds
+        :param vals: the learner settings of the config
+        """
+        x = self.get_features(vals, data)
+        return np.exp(x.dot(self.weights))
+
+    def update(self, vals, data, runtime):
+        """Refit the model with the observed runtime of one seed
+        """
+        if runtime < MIN_RUNTIME:
+            return
+        with self.lock:
+            self.X.append(self.get_features(vals, data))
+            self.y.append(np.log(runtime))
+            X = np.array(self.X)
+            y = np.array(self.y)
+            # ridge regression towards the prior, the intercept is free
+            penalty = PRIOR_WEIGHT * np.eye(len(self.prior))
+            penalty[0, 0] = 0.
+            self.weights = np.linalg.lstsq(
+                X.T.dot(X) + penalty, X.T.dot(y) + penalty.dot(self.prior),
+                rcond=None)[0]
+
+
+# cost models by config class, kept across searches in the same process
+MODELS = {}
+
+
+def get_cost_model(learner_config_space):
+    name = learner_config_space.Config.__name__
+    if name not in MODELS:
+        MODELS[name] = CostModel()
+    return MODELS[name]
+
+
+class CostSpace:
+
+    def __init__(self, learner_config_space, cost_model, data):
+        """A config space that generates configs in the order of decreasing
+        estimated runtime, and refines the estimates with the runtimes of the
+        results, otherwise the same as the wrapped space. Configs of a
+        `sequential` space, which proposes configs based on the results so
+        far, keep their order.
+        """
+        self.space = learner_config_space
+        self.cost_model = cost_model
+        self.data = data
+
+    def __getattr__(self, name):
+        return getattr(self.space, name)
+
+    def generate_config(self):
+        """Yield configs with their `estimated_runtime`, e.g. for ordering the
+        jobs of several searches, see `run.WorkerPool`
+        """
+        if getattr(self.space, 'sequential', False):
+            for c in self.space.generate_config():
+                c.estimated_runtime = self.cost_model.estimate(c.vals,
+                                                               self.data)
+                yield c
+            return
+        configs = list(self.space.generate_config())
+        costs = [self.cost_model.estimate(c.vals, self.data) for c in configs]
+        for c, x in zip(configs, costs):
+            c.estimated_runtime = x
+        order = np.argsort(-np.array(costs), kind='stable')
+        if configs:
+            LOGGER.debug("Estimated runtimes of one seed: %.3fs to %.3fs" % (
+                costs[order[-1]], costs[order[0]]))
+        for i in order:
+            yield configs[i]
+
+    def observe(self, result):
+        n_seeds = len(result.test_mse_list)
+        runtime = getattr(result, 'runtime', None)
+        if runtime is not None and n_seeds:
+            self.cost_model.update(dict(result.config_vals), self.data,
+                                   runtime / n_seeds)
+        self.space.observe(result)
+
+
+def longest_first(get_val_results):
+    """Schedule the configs passed to `get_val_results` longest first, see
+    `CostSpace`
+    """
+
+    def get_scheduled_val_results(data, learner_config_space, pc):
+        cost_model = get_cost_model(learner_config_space)
+        space = CostSpace(learner_config_space, cost_model, data)
+        return get_val_results(data, space, pc)
+
+    return get_scheduled_val_results
+
+
+class Bundler:
+
+    def __init__(self, target_time, max_size=100, smoothing=0.3):
+        """Groups configs into bundles that take about `target_time` seconds
+        to run, so that sending a job to a distributed worker costs less than
+        the work itself when configs take milliseconds, e.g. Lasso or KNN.
+        The runtime of a config is estimated with a moving average of the
+        observed runtimes; until one is observed, bundles hold one config.
+        :param target_time: seconds of work per bundle, 0 - one config per
+            bundle
+        :param max_size: the largest number of configs in a bundle
+        :param smoothing: the weight of the last runtime in the average
+        """
+        self.target_time = target_time
+        self.max_size = max_size
+        self.smoothing = smoothing
+        self.runtime = None
+
+    def observe(self, result):
+        runtime = getattr(result, 'runtime', None)
+        if runtime is None:
+            return
+        if self.runtime is None:
+            self.runtime = runtime
+        else:
+            self.runtime += self.smoothing * (runtime - self.runtime)
+
+    def get_size(self):
+        """Return the number of configs for the next bundle
+        """
+        if not self.target_time or self.runtime is None:
+            return 1
+        size = int(self.target_time / max(self.runtime, MIN_RUNTIME))
+        return min(max(1, size), self.max_size)
+
+    def generate_bundles(self, configs):
+        """Yield lists of configs, sized with the runtimes observed so far
+        when each bundle is taken
+        """
+        configs = iter(configs)
+        while True:
+            bundle = list(itertools.islice(configs, self.get_size()))
+            if not bundle:
+                return
+            yield bundle
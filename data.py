@@ -1,4 +1,5 @@
 import logging
+import hashlib
 
 from copy import deepcopy
 from collections import Counter
@@ -117,6 +118,9 @@ class Data:
         self.endog_test = None
         self.exog_test = None
 
+        # see `fingerprint`
+        self.data_hash = None
+
         self.preprocess(df)
 
     def __str__(self):
@@ -124,6 +128,21 @@ class Data:
             self.trainX.shape, self.trainY.shape, self.valX.shape,
             self.valY.shape, self.testX.shape, self.testY.shape)
 
+    def fingerprint(self):
+        """Return a hash of the prepared data, computed once
+        """
+        if self.data_hash is None:
+            h = hashlib.sha1()
+            for name in ['trainX', 'trainY', 'valX', 'valY', 'testX', 'testY',
+                         'trainYref', 'valYref', 'testYref']:
+                a = np.ascontiguousarray(getattr(self, name))
+                h.update(("%s%s%s" % (name, a.shape, a.dtype)).encode())
+                h.update(a.tobytes())
+            h.update(repr(getattr(self, 'feature_names_orig',
+                                  self.feature_names)).encode())
+            self.data_hash = h.hexdigest()
+        return self.data_hash
+
     def scale(self):
 
         if self.y_scaler is None:
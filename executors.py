@@ -0,0 +1,741 @@
+# -*- coding: utf-8 -*-
+"""
+Executors run the configs of a config space and collect their results: they
+are the `get_val_results` hook of `utils.run_config_space`, used by `run.py`,
+`run_zmq.py`, `run_celery.py` and `train.py`. The scheduling shared by all of
+them, i.e. grouping configs into jobs, collecting the results in the order
+they complete, and keeping the best validation RMSE for racing, is in
+`Executor`; a backend only runs the jobs:
+
+* "serial": in the current process
+* "thread": in a pool of threads, for learners that release the GIL
+* "process": in a `WorkerPool` of processes
+* "memory": in worker processes that take jobs from an in-memory queue, a
+  stand-in for a message broker, to try out distributed scheduling on one
+  machine
+* "zmq": in workers connected with `workers_zmq.py`, see `zmq_jobs.Master`
+* "celery": in Celery workers, see `workers_celery.py`
+* "sqlite": in workers that take jobs from a queue in an SQLite file, see
+  `sqlite_jobs.py`
+
+The backend is selected with the "executor" preprocessing setting, see
+`get_executor`.
+"""
+
+import os
+import time
+import queue
+import pickle
+import shutil
+import logging
+import tempfile
+import importlib
+import threading
+import traceback
+import multiprocessing
+
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+import numpy as np
+
+import cost
+from utils import run_config, run_bundle, is_candidate, TopResults
+
+
+LOGGER = logging.getLogger('main.executors')
+
+# the best validation RMSEs of the searches running in a pool, shared with
+# the pool workers for racing, see `Incumbent`
+INCUMBENTS = None
+# the directory the datasets are passed to pool workers in
+DATA_DIR = None
+# modules imported once by the forkserver, rather than by every new worker
+PRELOAD = ['numpy', 'pandas', 'scipy', 'sklearn', 'utils', 'learner_configs',
+           'executors']
+# heavy modules imported by learners only when they are trained
+LEARNER_MODULES = {
+        'LSTM': ['tensorflow'],
+        'BiLSTM': ['tensorflow'],
+        'XGBoost': ['xgboost', 'learner_wrappers'],
+        }
+
+
+def get_preload(learners):
+    """Return the modules for the forkserver to preload for the learners
+    """
+    modules = list(PRELOAD)
+    for learner in learners:
+        modules += [x for x in LEARNER_MODULES.get(learner, [])
+                    if x not in modules]
+    return modules
+
+
+class Datasets:
+
+    def __init__(self, max_datasets=1):
+        """The datasets kept by a worker, by fingerprint; the least recently
+        used are dropped when there are more than `max_datasets`
+        """
+        self.max_datasets = max_datasets
+        # the most recently used last
+        self.datasets = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.datasets
+
+    def put(self, key, data):
+        self.datasets[key] = data
+        self.datasets.move_to_end(key)
+        while len(self.datasets) > self.max_datasets:
+            self.datasets.popitem(last=False)
+
+    def get(self, key):
+        self.datasets.move_to_end(key)
+        return self.datasets[key]
+
+    def clear(self):
+        self.datasets.clear()
+
+
+# the datasets of a pool worker
+DATASETS = Datasets()
+
+
+def init_worker(incumbents, data_dir=None, max_datasets=1):
+    """Make the shared best validation RMSEs available to a pool worker
+    :param data_dir: the directory to load the datasets from
+    :param max_datasets: the number of datasets a worker keeps in memory
+    """
+    global INCUMBENTS, DATA_DIR
+    INCUMBENTS = incumbents
+    DATA_DIR = data_dir
+    DATASETS.max_datasets = max_datasets
+
+
+def get_data(key):
+    """Return the dataset with the fingerprint `key`, loading it only when
+    the worker sees it for the first time
+    """
+    if key not in DATASETS:
+        with open(os.path.join(DATA_DIR, key + ".pkl"), "rb") as f:
+            DATASETS.put(key, pickle.load(f))
+    return DATASETS.get(key)
+
+
+def run_cached_bundle(args):
+    """Run a bundle of configs on a dataset kept by the worker, see
+    `CeleryExecutor`
+    :param args: the fingerprint of the dataset, the dataset or None, a list
+        of configs, mode and the incumbent
+    :return: a list of results, or None if the dataset was not sent and the
+        worker does not have it
+    """
+    key, data, configs, mode, incumbent = args
+    if data is not None:
+        DATASETS.put(key, data)
+    elif key not in DATASETS:
+        return None
+    return run_bundle([DATASETS.get(key), configs, mode, incumbent])
+
+
+class Incumbent:
+
+    def __init__(self, values, slot):
+        """The best validation RMSE of one search, stored in a slot of an
+        array shared by the searches running in a pool, with the interface
+        of `multiprocessing.Value`
+        """
+        self.values = values
+        self.slot = slot
+
+    @property
+    def value(self):
+        return self.values[self.slot]
+
+    @value.setter
+    def value(self, value):
+        self.values[self.slot] = value
+
+
+def run_val_configs(args):
+    """Run a chunk of configs on the validation set
+    :param args: the fingerprint of the dataset, the slot of the incumbent
+        of the search, and a list of configs
+    """
+    key, slot, configs = args
+    data = get_data(key)
+    incumbent = Incumbent(INCUMBENTS, slot)
+    return [run_config([data, c, 'val', incumbent]) for c in configs]
+
+
+def get_chunks(inputs, chunksize):
+    """Group inputs into lists of up to `chunksize` items
+    """
+    inputs = iter(inputs)
+    while True:
+        chunk = list(islice(inputs, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+# put in the queue of a search when its next chunk is dispatched, see
+# `WorkerPool.imap`
+TAKEN = object()
+
+
+def get_priority(chunk):
+    """The estimated runtime of a chunk of configs, see `cost.CostSpace`
+    """
+    return sum(getattr(c, 'estimated_runtime', 0.) for c in chunk)
+
+
+class Search:
+
+    def __init__(self, key, slot, data=None, incumbent=None):
+        """The state of one search running in an executor, e.g. in a
+        `WorkerPool`
+        :param key: the fingerprint of the dataset
+        :param slot: the slot of the incumbent in a `WorkerPool`
+        :param incumbent: the best validation RMSE so far, an object with
+            the interface of `multiprocessing.Value`
+        """
+        self.key = key
+        self.slot = slot
+        self.data = data
+        self.incumbent = incumbent
+        # the next chunk to dispatch
+        self.head = None
+        self.exhausted = False
+        self.n_running = 0
+        # results of the chunks, then None when the search is complete
+        self.done = queue.Queue()
+
+
+class WorkerPool:
+
+    def __init__(self, n_jobs, max_searches=1, preload=PRELOAD):
+        """A pool of worker processes that can be reused for several config
+        spaces and datasets, e.g. for every step of a sweep in `train.py`.
+        Where available, workers are forked from a forkserver which imports
+        the `preload` modules once. A dataset is written to a temporary
+        file once, and each worker loads it once, on its first job.
+
+        Up to `max_searches` searches may run at the same time, e.g. from
+        several threads. Their chunks of configs are dispatched from one
+        queue, the most expensive first, keeping up to 2*n_jobs tasks in
+        flight, and more chunks are taken from a search only when there is
+        room, so that configs may be proposed from the results so far.
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(preload)
+        else:
+            context = multiprocessing.get_context()
+        self.n_jobs = n_jobs
+        self.n_in_flight = 2 * n_jobs
+        self.data_dir = tempfile.mkdtemp(prefix="forecastml-")
+        # the number of searches using each dataset
+        self.data_refs = Counter()
+        self.incumbents = context.Array('d', [np.inf] * max_searches)
+        self.free_slots = list(range(max_searches))
+        self.pool = context.Pool(n_jobs, initializer=init_worker,
+                                 initargs=(self.incumbents, self.data_dir,
+                                           max_searches))
+        self.searches = []
+        self.n_running = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def put_data(self, data):
+        """Make the dataset available to the workers
+        :return: the key of the dataset
+        """
+        key = data.fingerprint()
+        if not self.data_refs[key]:
+            path = os.path.join(self.data_dir, key + ".pkl")
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        self.data_refs[key] += 1
+        return key
+
+    def release_data(self, key):
+        self.data_refs[key] -= 1
+        if not self.data_refs[key]:
+            del self.data_refs[key]
+            os.remove(os.path.join(self.data_dir, key + ".pkl"))
+
+    def start_search(self, data):
+        """Reserve an incumbent slot and send the dataset for a new search,
+        waiting for another search to end if all slots are taken
+        """
+        with self.cond:
+            while not self.free_slots:
+                self.cond.wait()
+            slot = self.free_slots.pop(0)
+            self.incumbents[slot] = np.inf
+            key = self.put_data(data)
+        return Search(key, slot)
+
+    def end_search(self, search):
+        with self.cond:
+            if search in self.searches:
+                self.searches.remove(search)
+            self.release_data(search.key)
+            self.free_slots.append(search.slot)
+            self.cond.notify_all()
+
+    def imap(self, search, chunks):
+        """Run chunks of configs of a search, yielding the lists of results
+        in the order they complete
+        """
+        chunks = iter(chunks)
+        with self.cond:
+            self.searches.append(search)
+        self.take_chunk(search, chunks)
+        while True:
+            x = search.done.get()
+            if x is TAKEN:
+                self.take_chunk(search, chunks)
+                continue
+            if x is None:
+                return
+            if isinstance(x, BaseException):
+                raise x
+            yield x
+
+    def take_chunk(self, search, chunks):
+        """Take the next chunk of a search for the dispatcher; this runs in
+        the thread of the search, outside the lock, so that searches propose
+        configs in parallel
+        """
+        try:
+            chunk = next(chunks, None)
+        except BaseException:
+            with self.cond:
+                if search in self.searches:
+                    self.searches.remove(search)
+            raise
+        with self.cond:
+            if chunk is None:
+                search.exhausted = True
+                if search in self.searches:
+                    self.searches.remove(search)
+                if not search.n_running:
+                    search.done.put(None)
+            else:
+                search.head = chunk
+            self.cond.notify_all()
+
+    def get_next_search(self):
+        """Return the search with the most expensive next chunk
+        """
+        ready = [x for x in self.searches if x.head is not None]
+        if not ready:
+            return None
+        return max(ready, key=lambda x: get_priority(x.head))
+
+    def dispatch(self):
+        while True:
+            with self.cond:
+                search = None
+                while not self.closed:
+                    if self.n_running < self.n_in_flight:
+                        search = self.get_next_search()
+                        if search is not None:
+                            break
+                    self.cond.wait()
+                if self.closed:
+                    return
+                chunk, search.head = search.head, None
+                search.n_running += 1
+                self.n_running += 1
+                # the search takes its next chunk
+                search.done.put(TAKEN)
+            self.pool.apply_async(
+                run_val_configs, ((search.key, search.slot, chunk),),
+                callback=lambda x, s=search: self.complete(s, x),
+                error_callback=lambda x, s=search: self.complete(s, x))
+
+    def complete(self, search, x):
+        with self.cond:
+            search.n_running -= 1
+            self.n_running -= 1
+            search.done.put(x)
+            if search.exhausted and not search.n_running:
+                search.done.put(None)
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.dispatcher.join()
+
+    def terminate(self):
+        self.stop()
+        self.pool.terminate()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def close(self):
+        self.stop()
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class Value:
+
+    def __init__(self, value):
+        """The best validation RMSE of a search running in this process, with
+        the interface of `multiprocessing.Value`
+        """
+        self.value = value
+
+
+class Executor:
+
+    # group configs into jobs sized by their observed runtimes, see
+    # `cost.Bundler`, rather than by `pc['chunksize']`, e.g. where a job
+    # is a message to another machine
+    bundle = False
+    # searches may run from several threads at once, e.g. in `train.py`
+    concurrent = True
+
+    def get_val_results(self, data, learner_config_space, pc):
+        """Run the configs of the config space on the validation set
+        :param pc: preprocessing config
+        :return: the validation RMSEs and the results by config values
+        """
+        mse_scores = Counter()
+        results = {}
+        top = TopResults(pc.get('keep_top_k', 0))
+        configs = learner_config_space.generate_config()
+        if self.bundle:
+            bundler = cost.Bundler(pc.get('bundle_time', 1))
+            chunks = bundler.generate_bundles(configs)
+        else:
+            bundler = None
+            # cheap learners can be run several configs per task
+            chunks = get_chunks(configs, pc.get('chunksize', 1))
+        search = self.start_search(data)
+        try:
+            for chunk in self.map(search, chunks):
+                for x in chunk:
+                    mse_scores[x.config_vals] = x.test_mse
+                    results[x.config_vals] = x
+                    learner_config_space.observe(x)
+                    top.add(x)
+                    if bundler is not None:
+                        bundler.observe(x)
+                    if (is_candidate(x) and
+                            x.test_mse < search.incumbent.value):
+                        search.incumbent.value = x.test_mse
+        finally:
+            self.end_search(search)
+        return mse_scores, results
+
+    def start_search(self, data):
+        """Return the state of a new search on the dataset, see `Search`
+        """
+        return Search(data.fingerprint(), 0, data, Value(np.inf))
+
+    def map(self, search, chunks):
+        """Run lists of configs, yielding the lists of their results in the
+        order they complete; the chunks are taken only when there is room
+        for them, so that configs may be proposed from the results so far
+        """
+        raise NotImplementedError
+
+    def end_search(self, search):
+        pass
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        """Stop at once, e.g. on an error
+        """
+        self.close()
+
+
+class SerialExecutor(Executor):
+
+    def map(self, search, chunks):
+        for chunk in chunks:
+            yield [run_config([search.data, c, 'val', search.incumbent])
+                   for c in chunk]
+
+
+class ThreadExecutor(Executor):
+
+    def __init__(self, n_jobs):
+        """Run configs in `n_jobs` threads of this process, e.g. for learners
+        that spend their time in libraries that release the GIL
+        """
+        self.n_jobs = n_jobs
+        self.executor = ThreadPoolExecutor(n_jobs)
+
+    def map(self, search, chunks):
+
+        def run_chunk(chunk):
+            return [run_config([search.data, c, 'val', search.incumbent])
+                    for c in chunk]
+
+        running = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(running) < 2 * self.n_jobs:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    running.add(self.executor.submit(run_chunk, chunk))
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for x in done:
+                yield x.result()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def terminate(self):
+        self.executor.shutdown(wait=False)
+
+
+class ProcessExecutor(Executor):
+
+    def __init__(self, n_jobs, max_searches=1, preload=PRELOAD):
+        """Run configs in a `WorkerPool`, shared by up to `max_searches`
+        searches running at the same time
+        """
+        self.pool = WorkerPool(n_jobs, max_searches=max_searches,
+                               preload=preload)
+
+    def start_search(self, data):
+        search = self.pool.start_search(data)
+        search.incumbent = Incumbent(self.pool.incumbents, search.slot)
+        return search
+
+    def map(self, search, chunks):
+        return self.pool.imap(search, chunks)
+
+    def end_search(self, search):
+        self.pool.end_search(search)
+
+    def close(self):
+        self.pool.close()
+
+    def terminate(self):
+        self.pool.terminate()
+
+
+def serve(jobs, results, data_dir):
+    """Run the jobs of a `MemoryExecutor` until a None job; the traceback of
+    a job that raises is sent back instead of its results
+    """
+    init_worker(None, data_dir)
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, key, configs, incumbent = job
+        try:
+            data = get_data(key)
+            results.put((job_id, True,
+                         run_bundle([data, configs, 'val', incumbent])))
+        except Exception:
+            results.put((job_id, False, traceback.format_exc()))
+
+
+class MemoryExecutor(Executor):
+
+    bundle = True
+    # the results of all searches arrive in one queue
+    concurrent = False
+
+    def __init__(self, n_jobs, prefetch=2, preload=PRELOAD):
+        """Run configs in `n_jobs` worker processes that take jobs from an
+        in-memory queue in the way distributed workers take them from a
+        broker: jobs are bundles of configs that carry the fingerprint of
+        the dataset and the incumbent at the time they are sent, and are
+        pickled on the way to the workers and back
+        :param prefetch: the number of jobs queued per worker
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(preload)
+        else:
+            context = multiprocessing.get_context()
+        self.n_in_flight = n_jobs * prefetch
+        self.data_dir = tempfile.mkdtemp(prefix="forecastml-")
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.workers = [context.Process(target=serve, daemon=True,
+                                        args=(self.jobs, self.results,
+                                              self.data_dir))
+                        for _ in range(n_jobs)]
+        for x in self.workers:
+            x.start()
+        self.job_ids = 0
+
+    def start_search(self, data):
+        search = Executor.start_search(self, data)
+        path = os.path.join(self.data_dir, search.key + ".pkl")
+        with open(path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return search
+
+    def map(self, search, chunks):
+        running = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(running) < self.n_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    self.job_ids += 1
+                    running.add(self.job_ids)
+                    self.jobs.put((self.job_ids, search.key, chunk,
+                                   search.incumbent.value))
+            if not running:
+                return
+            try:
+                job_id, ok, results = self.results.get(timeout=1.)
+            except queue.Empty:
+                # a worker killed e.g. by the OOM killer sends nothing
+                if not all(x.is_alive() for x in self.workers):
+                    raise Exception("A worker process died")
+                continue
+            if job_id not in running:
+                # a job of a search that failed earlier
+                continue
+            if not ok:
+                raise Exception("Job %d failed:\n%s" % (job_id, results))
+            running.remove(job_id)
+            yield results
+
+    def end_search(self, search):
+        os.remove(os.path.join(self.data_dir, search.key + ".pkl"))
+
+    def close(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for x in self.workers:
+            x.join()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def terminate(self):
+        for x in self.workers:
+            x.terminate()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class CeleryExecutor(Executor):
+
+    bundle = True
+
+    # seconds between checks for completed jobs
+    poll_interval = 0.1
+
+    def __init__(self, max_pending=64, work=None):
+        """Run configs in Celery workers, see `workers_celery.py`. Jobs carry
+        the fingerprint of the dataset rather than the dataset: a worker
+        process keeps the datasets it has seen, and a job it cannot run is
+        sent again with the dataset. The results are consumed as they
+        complete.
+        :param max_pending: the number of jobs queued at once; later jobs are
+            bundled with the runtimes observed so far
+        :param work: the task to send the jobs to, `workers_celery.work`
+        """
+        if work is None:
+            # celery is optional, and only needed here
+            from workers_celery import work
+        self.work = work
+        self.max_pending = max_pending
+
+    def send(self, search, chunk, data=None):
+        return self.work.delay([search.key, data, chunk, 'val',
+                                search.incumbent.value])
+
+    def map(self, search, chunks):
+        # jobs are queued in the order of the config space, e.g. longest
+        # first, and the results are collected in the order they complete,
+        # so that at most `max_pending` jobs are held at once
+        pending = []
+        exhausted = False
+        # the first job carries the dataset, so that the worker running it
+        # does not ask for it
+        data = search.data
+        while True:
+            while not exhausted and len(pending) < self.max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.append((self.send(search, chunk, data), chunk))
+                    data = None
+            if not pending:
+                return
+            ready = [x for x in pending if x[0].ready()]
+            if not ready:
+                time.sleep(self.poll_interval)
+                continue
+            for x in ready:
+                pending.remove(x)
+                results = x[0].get()
+                if results is None:
+                    LOGGER.debug("A worker does not have the dataset, "
+                                 "sending it")
+                    pending.append((self.send(search, x[1], search.data),
+                                    x[1]))
+                else:
+                    yield results
+
+
+# executor classes by name, imported when used, as zmq and celery are optional
+EXECUTORS = {
+        'serial': 'executors.SerialExecutor',
+        'thread': 'executors.ThreadExecutor',
+        'process': 'executors.ProcessExecutor',
+        'memory': 'executors.MemoryExecutor',
+        'zmq': 'zmq_jobs.Master',
+        'sqlite': 'sqlite_jobs.Master',
+        'celery': 'executors.CeleryExecutor',
+        }
+
+
+def get_executor_name(pc):
+    """Return `pc['executor']`, or "process" if `pc['n_jobs']` > 1 and
+    "serial" otherwise
+    """
+    return pc.get('executor') or (
+        'process' if pc.get('n_jobs', 1) > 1 else 'serial')
+
+
+def get_executor(pc, name=None, preload=PRELOAD, **kwargs):
+    """Return an executor
+    :param pc: preprocessing config
+    :param name: the backend, by default `pc['executor']`, or "process" if
+        `pc['n_jobs']` > 1 and "serial" otherwise
+    :param preload: the modules for the forkserver to preload, see
+        `get_preload`
+    :param kwargs: passed to the executor, e.g. the address of the ZMQ master
+    """
+    if name is None:
+        name = get_executor_name(pc)
+    if name not in EXECUTORS:
+        raise Exception("Unknown executor: %s" % name)
+    if name in ('thread', 'process', 'memory'):
+        kwargs.setdefault('n_jobs', pc.get('n_jobs', 1))
+    if name in ('process', 'memory'):
+        kwargs['preload'] = preload
+    module, cls = EXECUTORS[name].rsplit('.', 1)
+    return getattr(importlib.import_module(module), cls)(**kwargs)
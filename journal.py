@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Crash-safe journal of validation results: every `Result` is appended to a
+file as soon as it arrives from the workers, so that an interrupted sweep
+can be resumed without evaluating the completed configs again.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import threading
+
+import cache
+from utils import strip_forecasts
+
+
+LOGGER = logging.getLogger('main.journal')
+
+
+def get_run_key(data, learner_config_space, pc):
+    """Return a key identifying one search over a config space, i.e. one call
+    of `get_val_results`
+    :param pc: preprocessing config
+    """
+    pc = sorted((k, v) for k, v in pc.items()
+                if k not in cache.RUNTIME_SETTINGS or
+                k in ['num_random_seeds', 'random_state'])
+    key = repr([data.fingerprint(), learner_config_space.Config.__name__, pc])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class JournalSpace:
+
+    def __init__(self, learner_config_space, journal, run_key):
+        """A config space that skips configs found in the journal and writes
+        results of the other configs to the journal, otherwise the same as the
+        wrapped space
+        """
+        self.space = learner_config_space
+        self.journal = journal
+        self.run_key = run_key
+        self.restored = {}
+
+    def __getattr__(self, name):
+        return getattr(self.space, name)
+
+    def generate_config(self):
+        completed = self.journal.results.get(self.run_key, {})
+        for c in self.space.generate_config():
+            config_vals = tuple(c.vals.items())
+            if config_vals in completed:
+                result = completed[config_vals]
+                self.restored[config_vals] = result
+                self.space.observe(result)
+                continue
+            yield c
+
+    def observe(self, result):
+        self.journal.write(self.run_key, result)
+        self.space.observe(result)
+
+
+class Journal:
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: the journal file
+        :param resume: if True, read results of the previous run from the
+            file, otherwise start a new journal
+        """
+        self.path = path
+        # results of the previous run by run key and config values, without
+        # their forecasts; results written by this run are not kept
+        self.results = {}
+        # searches may run in several threads, see `train.py`
+        self.lock = threading.Lock()
+        if resume:
+            self.read()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return
+        n = 0
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    run_key, result = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError,
+                        AttributeError):
+                    # the last record was cut short by a crash
+                    LOGGER.info("Ignoring an incomplete journal record")
+                    break
+                # the forecasts are computed again for the best config, see
+                # `utils.run_config_space`
+                self.results.setdefault(run_key, {})[result.config_vals] = \
+                    strip_forecasts(result)
+                n += 1
+        LOGGER.info("Read %d completed configs from %s" % (n, self.path))
+
+    def write(self, run_key, result):
+        with self.lock:
+            with open(self.path, "ab") as f:
+                pickle.dump((run_key, result), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def wrap(self, get_val_results):
+        """Journal the results of `get_val_results`, skipping configs with
+        results in the journal
+        """
+
+        def get_journaled_val_results(data, learner_config_space, pc):
+            run_key = get_run_key(data, learner_config_space, pc)
+            space = JournalSpace(learner_config_space, self, run_key)
+            mse_scores, results = get_val_results(data, space, pc)
+            # the restored results are needed by this search only
+            with self.lock:
+                self.results.pop(run_key, None)
+            for k, x in space.restored.items():
+                mse_scores[k] = x.test_mse
+                results[k] = x
+            if space.restored:
+                LOGGER.info("Restored %d configs from the journal"
+                            % len(space.restored))
+            return mse_scores, results
+
+        return get_journaled_val_results
@@ -19,13 +19,7 @@ from sklearn.neighbors import KNeighborsRegressor
 from sklearn.feature_selection import RFE
 from sklearn.preprocessing import PolynomialFeatures
 
-from learner_wrappers import XGBWrapper
-
-from tensorflow.keras import models
-from tensorflow.keras import layers
-from tensorflow.keras import callbacks
-from tensorflow.keras import regularizers
-from tensorflow.keras import backend
+import threads
 
 
 logging.getLogger("tensorflow").disabled = True
@@ -44,21 +38,45 @@ class ConfigSpace:
         """
         self.Config = Config
         self.dim = "3d" if Config is ConfigLSTM else "2d"
-        self.num_configs = 1
         self.parameter_ranges = adict
         self.pc = pc
         for k, v in self.parameter_ranges.items():
             setattr(self, k, v)
-            self.num_configs *= len(v)
-        LOGGER.info("Will evaluate %d configs" % self.num_configs)
+
+        # configs of the grid resulting in the same model, by their canonical
+        # form, which is used only as a key: it may not be in the grid
+        self.aliases = {}
+        self.canonical = {}
+        param_names, param_values = zip(*self.parameter_ranges.items())
+        for x in itertools.product(*param_values):
+            vals = dict(zip(param_names, x))
+            key = tuple(Config.canonical_vals(vals).items())
+            self.aliases.setdefault(key, []).append(tuple(vals.items()))
+            self.canonical[tuple(vals.items())] = key
+        self.num_configs = len(self.aliases)
+
+        num_duplicates = sum(len(x) - 1 for x in self.aliases.values())
+        LOGGER.info("Will evaluate %d configs, skipping %d duplicates" % (
+            self.num_configs, num_duplicates))
+
+    def generate_vals(self):
+        """Yield one hyperparameter configuration as a dictionary, once for
+        all configs resulting in the same model, the first of them in the grid
+        """
+        for aliases in self.aliases.values():
+            yield dict(aliases[0])
+
+    def get_aliases(self, config_vals):
+        """Return the configs resulting in the same model as `config_vals`
+        """
+        key = self.canonical.get(tuple(config_vals))
+        return self.aliases.get(key, [])
 
     def generate_config(self):
         """Yield one hyperparameter configuration
         """
-        param_names, param_values = zip(*self.parameter_ranges.items())
         i = 0
-        for x in itertools.product(*param_values):
-            adict = dict(zip(param_names, x))
+        for adict in self.generate_vals():
             yield self.Config(adict, self.pc)
             i += 1
             if i % 10 == 0:
@@ -70,9 +88,50 @@ class ConfigSpace:
         LOGGER.info("%s: completed %d of %d" % (datetime.now(),
                                         self.num_configs, self.num_configs))
 
+    def observe(self, result):
+        """Receive the validation result of a config generated by this space,
+        used by search strategies that propose configs sequentially
+        """
+        pass
+
+    def subspace(self, configs, pc=None):
+        """Return a config space made of selected hyperparameter settings
+        :param configs: a list of dictionaries with hyperparameter values
+        :param pc: preprocessing config, by default that of this space
+        """
+        return ConfigSubset(self.Config, configs,
+                            self.pc if pc is None else pc)
+
+
+class ConfigSubset(ConfigSpace):
+
+    def __init__(self, Config, configs, pc):
+        """
+        :param Config: learner config class
+        :param configs: a list of dictionaries with hyperparameter values
+        :param pc: preprocessing config
+        """
+        self.Config = Config
+        self.dim = "3d" if Config is ConfigLSTM else "2d"
+        self.configs = list(configs)
+        self.num_configs = len(self.configs)
+        self.parameter_ranges = {}
+        self.aliases = {}
+        self.canonical = {}
+        self.pc = pc
+
+    def generate_vals(self):
+        for adict in self.configs:
+            yield dict(adict)
+
 
 class Config:
 
+    # threads the learner may use, see `threads.get_n_threads`
+    n_threads = None
+    # the random generator of the seed being run, see `utils.seed_config`
+    rng = None
+
     def __init__(self, adict, pc):
 
         for k, v in adict.items():
@@ -97,6 +156,22 @@ class Config:
     def __str__(self):
         return self.name
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        """Return hyperparameter values in a canonical form, so that configs
+        resulting in the same model are equal
+        """
+        return dict(adict)
+
+    @classmethod
+    def reset_vals(cls, adict, names):
+        """Set hyperparameters that have no effect on the model to defaults
+        """
+        for name in names:
+            if name in adict:
+                adict[name] = getattr(cls, name, None)
+        return adict
+
     def train(self, data):
         if self.pc['rfe_step'] != 0 and self.pc['feature_selection'] > 0:
             model = self.rfe_fit(data)
@@ -190,10 +265,14 @@ class Config:
             results.append(pred_val)
 
         if first_forecast_error is not None:
-            LOGGER.info(f"{n_forecast_success} successes and ",
+            LOGGER.info(f"{n_forecast_success} successes and "
                 f"{n_forecast_errors} errors during forecasting")
             LOGGER.debug(f"First instance with error: {first_forecast_error}")
 
+        # the share of NaN predictions replaced above, for the last call
+        self.nan_fraction = n_forecast_errors / max(1,
+            n_forecast_errors + n_forecast_success)
+
         return np.array(results).reshape(-1, 1)
 
 
@@ -226,6 +305,18 @@ class ConfigKernelRidge(Config):
     coef0 = 1
     gamma = None
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        adict = dict(adict)
+        kernel = adict.get('kernel', cls.kernel)
+        if kernel == "linear":
+            return cls.reset_vals(adict, ['gamma', 'degree', 'coef0'])
+        elif kernel in ["rbf", "laplacian", "chi2"]:
+            return cls.reset_vals(adict, ['degree', 'coef0'])
+        elif kernel == "sigmoid":
+            return cls.reset_vals(adict, ['degree'])
+        return adict
+
     def init_model(self):
         return KernelRidge(alpha=self.alpha, kernel=self.kernel,
             degree=self.degree, coef0=self.coef0, gamma=self.gamma)
@@ -237,7 +328,8 @@ class ConfigKNN(Config):
     p = 2
 
     def init_model(self):
-        return KNeighborsRegressor(n_neighbors=self.n_neighbors, p=self.p)
+        return KNeighborsRegressor(n_neighbors=self.n_neighbors, p=self.p,
+                                   n_jobs=self.n_threads)
 
 
 class ConfigSVR(Config):
@@ -254,7 +346,7 @@ class ConfigLSVR(ConfigSVR):
 
     def init_model(self):
         return LinearSVR(C=self.c, epsilon=self.eps, tol=self.tol, max_iter=
-            self.max_iter, dual=self.dual)
+            self.max_iter, dual=self.dual, random_state=self.pc['random_state'])
 
 
 class ConfigSVRpoly(ConfigSVR):
@@ -276,6 +368,10 @@ class ConfigSVRsigmoid(ConfigSVR):
     gamma = "scale"
     max_iter = -1
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        return cls.reset_vals(dict(adict), ['degree'])
+
     def init_model(self):
         return SVR(kernel="sigmoid", C=self.c, epsilon=self.eps, tol=self.tol,
             max_iter=self.max_iter, coef0=self.coef0, gamma=self.gamma)
@@ -286,6 +382,10 @@ class ConfigSVRrbf(ConfigSVR):
     gamma = "scale"
     max_iter = -1
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        return cls.reset_vals(dict(adict), ['degree', 'coef0'])
+
     def init_model(self):
         return SVR(kernel="rbf", C=self.c, epsilon=self.eps, tol=self.tol,
             max_iter=self.max_iter, gamma=self.gamma)
@@ -313,13 +413,21 @@ class ConfigRFR(Config):
     min_samples_leaf = 1
     max_leaf_nodes = None
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        adict = dict(adict)
+        # for regression, "auto" uses all features
+        if adict.get('max_features') == 1.0:
+            adict['max_features'] = 'auto'
+        return adict
+
     def init_model(self):
         return RandomForestRegressor(n_estimators=self.n_estimators,
             max_features=self.max_features, max_depth=self.max_depth,
             min_samples_split=self.min_samples_split,
             min_samples_leaf=self.min_samples_leaf,
             max_leaf_nodes=self.max_leaf_nodes,
-            random_state=self.pc['random_state'])
+            random_state=self.pc['random_state'], n_jobs=self.n_threads)
 
 
 class ConfigGB(Config):
@@ -338,6 +446,18 @@ class ConfigGB(Config):
     warm_start = False
     early_stopping = None
 
+    @classmethod
+    def canonical_vals(cls, adict):
+        adict = dict(adict)
+        # all of these use all features
+        if adict.get('max_features') in ['auto', 1.0]:
+            adict['max_features'] = None
+        # alpha is used only by the huber and quantile losses
+        if adict.get('loss', cls.loss) not in ['huber', 'quantile']:
+            cls.reset_vals(adict, ['alpha'])
+        # each model is fitted from scratch
+        return cls.reset_vals(adict, ['warm_start'])
+
     def init_model(self, early_stopping=None, num_train=None):
         return GradientBoostingRegressor(n_estimators=self.n_estimators,
             learning_rate=self.learning_rate, loss=self.loss,
@@ -364,10 +484,13 @@ class ConfigXGBoost(Config):
     early_stopping = None
 
     def init_model(self, early_stopping=None, num_train=None):
+        # xgboost is imported only when used
+        from learner_wrappers import XGBWrapper
         return XGBWrapper(max_depth=self.max_depth,
             objective=self.objective, n_estimators=self.n_estimators,
             learning_rate=self.learning_rate, booster=self.booster,
-            reg_alpha=self.reg_alpha, n_jobs=self.n_jobs, nthread=self.n_jobs,
+            reg_alpha=self.reg_alpha, n_jobs=self.n_threads or self.n_jobs,
+            nthread=self.n_threads or self.n_jobs,
             random_state=self.pc['random_state'],
             early_stopping=early_stopping, num_train=num_train)
 
@@ -387,14 +510,36 @@ class ConfigLSTM(Config):
     stateful = None
 
     def fit(self, data):
-        """Importing Keras to be able to use it with multiprocessing
+        """Importing Keras to be able to use it with multiprocessing, and to
+        load TensorFlow only when an LSTM is trained
         """
-
+        from tensorflow.keras import models
+        from tensorflow.keras import layers
+        from tensorflow.keras import callbacks
+        from tensorflow.keras import regularizers
+        from tensorflow.keras import initializers
+        from tensorflow.keras import backend
+
+        threads.set_tensorflow_threads(self.n_threads)
         backend.clear_session()
 
         LOGGER.debug("Pid: %s: training LSTM ..." % os.getpid())
 
-        np.random.seed(self.pc['random_state'])
+        # the initializers and dropout layers are seeded from the generator
+        # of the random seed rather than from the global state, which is
+        # shared by seeds trained in parallel threads
+        rng = self.rng
+        if rng is None:
+            rng = np.random.default_rng(self.pc['random_state'])
+
+        def get_seed():
+            return int(rng.integers(2 ** 31))
+
+        def get_lstm_initializers():
+            return {'kernel_initializer':
+                        initializers.GlorotUniform(seed=get_seed()),
+                    'recurrent_initializer':
+                        initializers.Orthogonal(seed=get_seed())}
 
         model = models.Sequential()
 
@@ -414,7 +559,8 @@ class ConfigLSTM(Config):
                       activation=self.activation,
                       return_sequences=return_sequences_on_input,
                       kernel_regularizer=kernel_regularizer,
-                      bias_regularizer=bias_regularizer),
+                      bias_regularizer=bias_regularizer,
+                      **get_lstm_initializers()),
                       input_shape=(None, data.trainX.shape[2]),))
         else:
             model.add(layers.LSTM(input_shape=(None, data.trainX.shape[2]),
@@ -422,10 +568,11 @@ class ConfigLSTM(Config):
                     activation=self.activation,
                     return_sequences=return_sequences_on_input,
                     kernel_regularizer=kernel_regularizer,
-                    bias_regularizer=bias_regularizer))
+                    bias_regularizer=bias_regularizer,
+                    **get_lstm_initializers()))
 
         if self.dropout_rate:
-            model.add(layers.Dropout(self.dropout_rate))
+            model.add(layers.Dropout(self.dropout_rate, seed=get_seed()))
 
         # hidden layers
         for i, n_layer in enumerate(self.topology[1:-1]):
@@ -434,16 +581,19 @@ class ConfigLSTM(Config):
                 model.add(layers.Bidirectional(layers.LSTM(
                                     n_layer, return_sequences=return_seq,
                                     kernel_regularizer=kernel_regularizer,
-                                    bias_regularizer=bias_regularizer)))
+                                    bias_regularizer=bias_regularizer,
+                                    **get_lstm_initializers())))
             else:
                 model.add(layers.LSTM(n_layer, return_sequences=return_seq,
                             kernel_regularizer=kernel_regularizer,
-                            bias_regularizer=bias_regularizer))
+                            bias_regularizer=bias_regularizer,
+                            **get_lstm_initializers()))
             if self.dropout_rate:
-                model.add(layers.Dropout(self.dropout_rate))
+                model.add(layers.Dropout(self.dropout_rate, seed=get_seed()))
 
         # output layer
-        model.add(layers.Dense(units=self.topology[-1]))
+        model.add(layers.Dense(units=self.topology[-1],
+            kernel_initializer=initializers.GlorotUniform(seed=get_seed())))
 
         model.compile(loss="mean_squared_error", optimizer=self.optimizer)
 
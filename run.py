@@ -1,51 +1,54 @@
 import sys
 import os
-import multiprocessing
-import importlib
 import json
 import time
-
-from collections import Counter
+import logging
+import importlib
 
 import settings
+import threads
 import numpy as np
 np.random.seed(settings.PREPROCESSING['random_state'])
 
-from utils import run_config_space, run_config
+from utils import run_config_space
+from executors import get_executor, get_preload
+from journal import Journal
 from get_logger import get_logger
 from learner_configs import ConfigSpace
 
 
-LOGGER = None
+LOGGER = logging.getLogger('main.run')
+# the executor used by every call of `get_val_results`, e.g. a pool of
+# processes shared by the steps of a sweep in `train.py`
+EXECUTOR = None
 
 
 def get_val_results(d, learner_config_space, pc):
     """Search for best parameters on the validation set
     :param pc: preprocessing config
     """
-
-    mse_scores = Counter()
-    results = {}
-    if pc['n_jobs'] == 1:
-        for c in learner_config_space.generate_config():
-            x = run_config([d, c, 'val'])
-            mse_scores[x.config_vals] = x.test_mse
-            results[x.config_vals] = x
-    else:
-        inputs = iter([d, c, 'val']
-                        for c in learner_config_space.generate_config())
-        pool = multiprocessing.Pool(pc['n_jobs'])
-        outputs = pool.imap(run_config, inputs)
-        for x in outputs:
-            mse_scores[x.config_vals] = x.test_mse
-            results[x.config_vals] = x
-
-    return mse_scores, results
-
-
-def main():
-
-    global learner
+    if EXECUTOR is not None:
+        return EXECUTOR.get_val_results(d, learner_config_space, pc)
+    executor = get_executor(pc)
+    try:
+        val_results = executor.get_val_results(d, learner_config_space, pc)
+    except BaseException:
+        executor.terminate()
+        raise
+    executor.close()
+    return val_results
+
+
+def main(learner, executor=None, journal_file=None):
+    """Search the config space of the learner, and append the test results
+    to results.json
+    :param executor: the executor to run the configs with, see
+        `executors.py`, by default the one selected by the preprocessing
+        settings; it is closed at the end
+    :param journal_file: the journal of completed configs, to resume an
+        interrupted run with the --resume flag
+    """
+    global EXECUTOR
 
     start = time.time()
 
@@ -59,9 +62,27 @@ def main():
     config_space = ConfigSpace(LearnerConfig, learner_config_settings,
                                preproc_config)
 
-    # train and test
-    test_result = run_config_space(preproc_config, config_space,
-                                   get_val_results)
+    # journal of completed configs, to resume an interrupted run
+    journal = Journal(journal_file or 'logs/journal_%s.pkl' % learner,
+                      resume='--resume' in sys.argv[2:])
+
+    # train and test, reusing the executor for every step of the search
+    if executor is None:
+        if preproc_config['n_jobs'] > 1:
+            # library threads of the workers, see `threads.py`
+            os.environ.update(threads.get_env(preproc_config, [learner]))
+        executor = get_executor(preproc_config,
+                                preload=get_preload([learner]))
+    EXECUTOR = executor
+    try:
+        test_result = run_config_space(preproc_config, config_space,
+                                       get_val_results, journal=journal)
+    except BaseException:
+        executor.terminate()
+        raise
+    finally:
+        EXECUTOR = None
+    executor.close()
 
     if os.path.exists("results.json"):
         all_results = json.load(open("results.json"))
@@ -80,5 +101,5 @@ def main():
 if __name__ == "__main__":
     learner = sys.argv[1]
     assert learner in settings.__dict__
-    LOGGER = get_logger('main', 'logs/%s.log' % learner)
-    main()
+    get_logger('main', 'logs/%s.log' % learner)
+    main(learner)
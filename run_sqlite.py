@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Usage:
+
+python run_sqlite.py LEARNER [--resume]
+
+Adds the configs to the job queue in `settings.SQLITE["queue_file"]`, see
+`sqlite_jobs.py`, and collects the results written by `workers_sqlite.py`.
+"""
+
+import sys
+
+import settings
+
+import run
+from executors import get_executor
+from get_logger import get_logger
+
+
+learner = sys.argv[1]
+assert learner in settings.__dict__
+LOGGER = get_logger('main', 'logs/run_sqlite_%s.log' % learner)
+
+
+def main():
+    executor = get_executor(settings.PREPROCESSING, 'sqlite',
+                            path=settings.SQLITE["queue_file"],
+                            lease_timeout=settings.SQLITE["lease_timeout"],
+                            poll_interval=settings.SQLITE["poll_interval"],
+                            max_pending=settings.SQLITE["max_pending"])
+    run.main(learner, executor, 'logs/journal_sqlite_%s.pkl' % learner)
+
+
+if __name__ == "__main__":
+
+    main()
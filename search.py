@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Search strategies over a config space. A strategy wraps the
+`get_val_results` function of a runner (see `run.py`, `run_zmq.py`,
+`run_celery.py`) and is selected with the "search" preprocessing setting.
+"""
+
+import time
+import logging
+import itertools
+
+from copy import copy
+from datetime import datetime
+from collections import Counter
+
+import numpy as np
+
+import utils
+
+
+LOGGER = logging.getLogger('main.search')
+
+
+def subsample_train(data, fraction):
+    """Return a copy of the data keeping only the most recent `fraction` of
+    the training instances
+    """
+    if fraction >= 1.0:
+        return data
+    n = max(data.horizon + 1, int(data.trainX.shape[0] * fraction))
+    d = copy(data)
+    d.trainX = data.trainX[-n:]
+    d.trainY = data.trainY[-n:]
+    d.trainYref = data.trainYref[-(n - data.horizon + 1):]
+    d.data_hash = None
+    return d
+
+
+def get_budget(data, pc, fraction):
+    """Return the data and the preprocessing config for a fraction of the
+    full budget: either fewer random seeds or fewer training instances
+    :param pc: preprocessing config
+    """
+    resource = pc.get('halving_resource', 'seeds')
+    if resource == 'seeds':
+        if pc['num_random_seeds'] == 0:
+            return data, dict(pc)
+        num_seeds = max(1, int(round(pc['num_random_seeds'] * fraction)))
+        return data, dict(pc, num_random_seeds=num_seeds)
+    elif resource == 'data':
+        return subsample_train(data, fraction), dict(pc)
+    raise Exception("Unknown halving resource: %s" % resource)
+
+
+def successive_halving(get_val_results):
+    """Successive halving: evaluate all configs on a small budget and promote
+    the best 1/`halving_eta` of them to a budget `halving_eta` times larger,
+    over `halving_rungs` rungs, the last of which uses the full budget.
+
+    Configs that were not promoted are marked as pruned, so that they are
+    never selected as the best config.
+    """
+
+    def get_halving_val_results(data, learner_config_space, pc):
+        eta = pc.get('halving_eta', 3)
+        n_rungs = pc.get('halving_rungs', 3)
+
+        mse_scores = Counter()
+        results = {}
+        configs = list(learner_config_space.generate_vals())
+
+        for rung in range(n_rungs):
+            fraction = float(eta) ** (rung - n_rungs + 1)
+            rung_data, rung_pc = get_budget(data, pc, fraction)
+            LOGGER.info("Successive halving rung %d: %d configs, budget %.3f"
+                        % (rung, len(configs), fraction))
+
+            rung_space = learner_config_space.subspace(configs, rung_pc)
+            rung_scores, rung_results = get_val_results(rung_data, rung_space,
+                                                        rung_pc)
+            for k, x in rung_results.items():
+                mse_scores[k] = rung_scores[k]
+                results[k] = x
+
+            if rung == n_rungs - 1:
+                break
+
+            # promote the best configs to the next rung
+            ranked = sorted((k for k, x in rung_results.items()
+                             if utils.is_candidate(x)),
+                            key=lambda k: rung_scores[k])
+            promoted = ranked[:max(1, len(configs) // eta)]
+            for k, x in rung_results.items():
+                if k not in promoted:
+                    x.pruned = True
+            if not promoted:
+                break
+            configs = [dict(k) for k in promoted]
+
+        return mse_scores, results
+
+    return get_halving_val_results
+
+
+def parzen(indices, n_values, ordinal, prior_weight=1.0):
+    """Estimate a distribution over the values of one hyperparameter from the
+    indices of observed values, smoothing across neighbouring values for
+    ordered (numeric) hyperparameters, mixed with a uniform prior
+    """
+    grid = np.arange(n_values)
+    density = np.full(n_values, prior_weight / n_values)
+    if len(indices):
+        indices = np.asarray(indices)[:, np.newaxis]
+        if ordinal:
+            kernel = np.exp(-0.5 * (grid[np.newaxis, :] - indices) ** 2)
+            kernel /= kernel.sum(axis=1, keepdims=True)
+        else:
+            kernel = (grid[np.newaxis, :] == indices).astype(float)
+        density += kernel.sum(axis=0)
+    return density / density.sum()
+
+
+class TPESpace:
+
+    # configs are proposed based on the results so far, see `cost.CostSpace`
+    sequential = True
+
+    def __init__(self, learner_config_space, pc):
+        """A config space proposing configs one by one with a Tree-structured
+        Parzen Estimator: configs are sampled from the density of the best
+        `tpe_gamma` share of the observed configs, and the one maximizing the
+        ratio of that density to the density of the remaining configs is
+        proposed. Proposals use the results observed so far, so that
+        parallel workers can be kept busy. The search stops after
+        `tpe_max_evals` configs or `tpe_max_time` seconds.
+        :param learner_config_space: the config space to search
+        :param pc: preprocessing config
+        """
+        self.Config = learner_config_space.Config
+        self.dim = learner_config_space.dim
+        self.pc = pc
+        self.param_names = list(learner_config_space.parameter_ranges.keys())
+        self.param_values = [list(learner_config_space.parameter_ranges[k])
+                             for k in self.param_names]
+        self.ordinal = [all(isinstance(v, (int, float)) for v in values)
+                        for values in self.param_values]
+        self.num_configs = min(pc.get('tpe_max_evals', 100),
+                               learner_config_space.num_configs)
+        self.max_time = pc.get('tpe_max_time', 0)
+        self.n_startup = pc.get('tpe_startup', 10)
+        self.gamma = pc.get('tpe_gamma', 0.25)
+        self.n_candidates = pc.get('tpe_candidates', 24)
+        self.rng = np.random.default_rng(pc.get('random_state'))
+
+        # index vectors of proposed configs, and observed scores
+        self.proposed = {}
+        self.observed = []
+        self.indices_by_vals = {}
+
+    def get_vals(self, indices):
+        return dict((k, values[i]) for k, values, i in zip(
+            self.param_names, self.param_values, indices))
+
+    def get_random(self):
+        """Return an index vector of a config not proposed yet, or None if
+        all configs were proposed
+        """
+        for _ in range(100):
+            indices = tuple(int(self.rng.integers(len(values)))
+                            for values in self.param_values)
+            if indices not in self.proposed:
+                return indices
+        for indices in itertools.product(*(range(len(values))
+                                           for values in self.param_values)):
+            if indices not in self.proposed:
+                return indices
+        return None
+
+    def propose(self):
+        """Return the index vector of the next config to evaluate
+        """
+        if len(self.observed) < self.n_startup:
+            return self.get_random()
+
+        indices, scores = zip(*self.observed)
+        indices = np.array(indices)
+        order = np.argsort(scores, kind='stable')
+        n_good = max(1, int(np.ceil(self.gamma * len(order))))
+        good, bad = indices[order[:n_good]], indices[order[n_good:]]
+
+        candidates = []
+        log_ratio = np.zeros(self.n_candidates)
+        for j, values in enumerate(self.param_values):
+            l = parzen(good[:, j], len(values), self.ordinal[j])
+            g = parzen(bad[:, j], len(values), self.ordinal[j])
+            sample = self.rng.choice(len(values), self.n_candidates, p=l)
+            candidates.append(sample)
+            log_ratio += np.log(l[sample]) - np.log(g[sample])
+
+        candidates = np.array(candidates).T
+        for i in np.argsort(-log_ratio, kind='stable'):
+            proposal = tuple(int(x) for x in candidates[i])
+            if proposal not in self.proposed:
+                return proposal
+        return self.get_random()
+
+    def get_key(self, adict):
+        """Configs resulting in the same model have the same key, see
+        `Config.canonical_vals`
+        """
+        return tuple(self.Config.canonical_vals(adict).items())
+
+    def generate_config(self):
+        """Yield configs proposed from the results observed so far
+        """
+        start = time.time()
+        i = 0
+        while i < self.num_configs:
+            if self.max_time and time.time() - start > self.max_time:
+                LOGGER.info("TPE search: time budget reached")
+                break
+            indices = self.propose()
+            if indices is None:
+                break
+            adict = self.get_vals(indices)
+            self.proposed[indices] = self.get_key(adict)
+            # skip configs resulting in the same model as an earlier one
+            if self.proposed[indices] in self.indices_by_vals:
+                continue
+            self.indices_by_vals[self.proposed[indices]] = indices
+            yield self.Config(adict, self.pc)
+            i += 1
+            if i % 10 == 0:
+                LOGGER.info("%s: proposed %d of %d" % (datetime.now(), i,
+                                                       self.num_configs))
+
+    def observe(self, result):
+        """Record the validation RMSE of a proposed config
+        """
+        indices = self.indices_by_vals.get(
+            self.get_key(dict(result.config_vals)))
+        if indices is None:
+            return
+        score = result.test_mse if utils.is_candidate(result) else np.inf
+        self.observed.append((indices, score))
+
+
+def tpe(get_val_results):
+    """Sequential model-based search, see `TPESpace`
+    """
+
+    def get_tpe_val_results(data, learner_config_space, pc):
+        return get_val_results(data, TPESpace(learner_config_space, pc), pc)
+
+    return get_tpe_val_results
+
+
+class DeadlineSpace:
+
+    def __init__(self, learner_config_space, time_budget):
+        """A config space that stops generating configs when the time budget
+        runs out, otherwise the same as the wrapped space
+        """
+        self.space = learner_config_space
+        self.time_budget = time_budget
+
+    def __getattr__(self, name):
+        return getattr(self.space, name)
+
+    def generate_config(self):
+        configs = self.space.generate_config()
+        while not self.time_budget.is_expired():
+            c = next(configs, None)
+            if c is None:
+                return
+            yield c
+
+
+class TimeBudget:
+
+    def __init__(self, seconds):
+        """A wall-clock budget for the search over a config space: once it
+        runs out, no more configs are scheduled and the jobs in flight are
+        left to finish
+        :param seconds: the budget in seconds
+        """
+        self.deadline = time.time() + seconds
+        self.expired = False
+
+    def is_expired(self):
+        if not self.expired and time.time() > self.deadline:
+            LOGGER.info("Time budget ran out, not scheduling more configs")
+            self.expired = True
+        return self.expired
+
+    def wrap(self, get_val_results):
+        """Apply the budget to every config space passed to `get_val_results`
+        """
+
+        def get_budgeted_val_results(data, learner_config_space, pc):
+            return get_val_results(data, DeadlineSpace(learner_config_space,
+                                                       self), pc)
+
+        return get_budgeted_val_results
+
+
+def get_search(pc, get_val_results):
+    """Wrap a runner's `get_val_results` with the search strategy
+    :param pc: preprocessing config
+    """
+    search = pc.get('search', 'grid')
+    if search == 'grid':
+        return get_val_results
+    elif search == 'halving':
+        return successive_halving(get_val_results)
+    elif search == 'tpe':
+        return tpe(get_val_results)
+    raise Exception("Unknown search strategy: %s" % search)
@@ -16,14 +16,52 @@ PREPROCESSING = {
         "scaler_name": "minmax", # minmax, standard
         "scale_range": [0, 1],
         "n_jobs": 1,
+        "executor": None, # serial, thread, process, memory, None - process if n_jobs > 1, otherwise serial
+        "chunksize": 1, # configs per pool task, larger for cheap learners
+        "bundle_time": 1, # seconds of work per job sent to zmq or celery workers, 0 - one config per job
+        "concurrent_searches": 4, # sweep steps sharing the pool in train.py
+        "longest_first": 1, # schedule configs by decreasing estimated runtime, 0 or 1
+        "keep_top_k": 10, # keep the forecasts of the configs with the k lowest validation RMSEs, 0 - all
+        "seed_n_jobs": 1, # parallel random seeds within one config
+        "seed_executor": "thread", # thread, process
+        "thread_budget": None, # static, adaptive, None - library defaults
+        "n_cores": None, # cores to share between workers and library threads, None - all
         "freq_threshold": 0,
         "dep_var_name": "dep_var",
         "num_random_seeds": 10,
+        "racing": 0, # abandon remaining seeds of clearly losing configs, 0 or 1
+        "racing_min_seeds": 3,
+        "racing_confidence": 0.95,
+        "degenerate_exit": 1, # stop after the first seed if forecasts are constant or NaN
+        "max_nan_fraction": 0.5,
+        "search": "grid", # grid, halving, tpe
+        "halving_eta": 3, # keep the best 1/eta configs at each rung
+        "halving_rungs": 3,
+        "halving_resource": "seeds", # seeds, data
+        "tpe_max_evals": 100,
+        "tpe_max_time": 0, # seconds, 0 - no limit
+        "time_budget": 0, # seconds for the whole search, 0 - no limit
+        "cache_file": None, # e.g. "cache/results.sqlite", None - no caching
+        "cache_max_mb": 1024,
         "random_state": None
         }
 
 ZMQ = {
-       "master_address": "tcp://127.0.0.1:5557"
+       "master_address": "tcp://127.0.0.1:5557",
+       "prefetch": 2, # jobs queued at each worker
+       "heartbeat_interval": 1, # seconds between heartbeats of a worker
+       "heartbeat_timeout": 10, # seconds after which a silent worker's jobs are requeued
+       "lease_timeout": 0, # seconds after which a job is requeued, 0 - no limit
+       "slim_results": 1 # leave out in-sample forecasts except for the best config, 0 or 1
+       }
+
+SQLITE = {
+       "queue_file": "queue/jobs.sqlite", # on a filesystem shared by the workers
+       "lease_timeout": 60, # seconds after which the jobs of a silent worker are claimed again
+       "poll_interval": 1, # seconds between checks for jobs and results
+       "max_pending": 100, # jobs added by the master and not yet finished
+       "max_attempts": 3, # leases of a job that expire before it fails, e.g. a job that crashes its workers
+       "idle_timeout": None # seconds without jobs after which workers exit, None - never
        }
 
 GB = {
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+A job queue in an SQLite file, for running a search on any number of worker
+processes that can open the file, e.g. on several machines sharing a network
+filesystem, without a message broker or a fixed master address.
+
+The master (`run_sqlite.py`) adds a job for every config, and workers
+(`workers_sqlite.py`) claim pending jobs atomically, run them, and write the
+results back. A claimed job is leased to the worker: the worker renews the
+lease while it runs, and a job whose lease is not renewed for
+`lease_timeout` seconds, e.g. because the worker crashed, is claimed again
+by another worker.
+
+Jobs are keyed by the dataset, the learner, the preprocessing config and the
+learner settings, so the master may exit at any time: run again, it finds
+the jobs it added, and collects the results completed in the meantime.
+The best validation RMSE of each search is kept in the file as well, and
+sent with every job for racing.
+
+SQLite relies on file locks, so the filesystem must support them, e.g. NFS
+with locking enabled.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+import traceback
+
+from contextlib import closing, contextmanager
+
+import cache
+import cost
+import utils
+from executors import Executor, Datasets
+
+
+LOGGER = logging.getLogger('main.sqlite_jobs')
+
+# the number of job ids in one query
+MAX_IDS = 500
+
+
+def get_search_key(data_key, c):
+    """Return a key identifying the search a config belongs to
+    :param data_key: the fingerprint of the dataset
+    :param c: learner config
+    """
+    pc = sorted((k, v) for k, v in c.pc.items()
+                if k not in cache.RUNTIME_SETTINGS or
+                k in ['num_random_seeds', 'random_state'])
+    key = repr([data_key, c.learner, pc])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class JobQueue:
+
+    def __init__(self, path, lease_timeout=60., max_attempts=3):
+        """
+        :param path: the SQLite file
+        :param lease_timeout: seconds after which a job whose lease was not
+            renewed is claimed again
+        :param max_attempts: the number of leases after which a job whose
+            lease expires fails, e.g. one that kills its workers
+        """
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS datasets (key TEXT "
+                         "PRIMARY KEY, value BLOB)")
+            conn.execute("CREATE TABLE IF NOT EXISTS searches (search TEXT "
+                         "PRIMARY KEY, incumbent REAL)")
+            # state is one of pending, leased, done and failed
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER "
+                         "PRIMARY KEY, key TEXT UNIQUE, search TEXT, "
+                         "data_key TEXT, config BLOB, state TEXT, "
+                         "worker TEXT, leased_at REAL, n_attempts INTEGER, "
+                         "result BLOB)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs "
+                         "(state, id)")
+
+    @contextmanager
+    def connect(self):
+        """A connection in a transaction, closed afterwards; one per
+        operation, as the queue is used from several threads and processes
+        """
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn:
+            with conn:
+                yield conn
+
+    def put_data(self, key, data):
+        with self.connect() as conn:
+            if conn.execute("SELECT 1 FROM datasets WHERE key = ?",
+                            (key,)).fetchone() is None:
+                conn.execute("INSERT OR IGNORE INTO datasets VALUES (?, ?)",
+                             (key, pickle.dumps(data,
+                                                pickle.HIGHEST_PROTOCOL)))
+
+    def get_data(self, key):
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM datasets WHERE key = ?",
+                               (key,)).fetchone()
+        return pickle.loads(row[0])
+
+    def submit(self, data_key, c):
+        """Add a job for the config, unless there is one already that has
+        not failed
+        :return: the id of the job
+        """
+        search = get_search_key(data_key, c)
+        key = hashlib.sha1(repr([search, sorted(c.vals.items())]).encode()
+                           ).hexdigest()
+        with self.connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO searches VALUES (?, NULL)",
+                         (search,))
+            conn.execute("INSERT OR IGNORE INTO jobs (key, search, data_key, "
+                         "config, state, n_attempts) VALUES (?, ?, ?, ?, "
+                         "'pending', 0)",
+                         (key, search, data_key,
+                          pickle.dumps(c, pickle.HIGHEST_PROTOCOL)))
+            # a job that failed in an earlier run is tried again
+            conn.execute("UPDATE jobs SET state = 'pending', n_attempts = 0 "
+                         "WHERE key = ? AND state = 'failed'", (key,))
+            return conn.execute("SELECT id FROM jobs WHERE key = ?",
+                                (key,)).fetchone()[0]
+
+    def claim(self, worker, n=1):
+        """Lease up to `n` jobs to the worker, the pending jobs and the jobs
+        past their lease, in the order they were added; a job past its
+        `max_attempts`-th lease fails instead
+        :return: a list of job ids, search keys, dataset fingerprints,
+            configs and incumbents
+        """
+        now = time.time()
+        with self.connect() as conn:
+            # take the write lock before reading, so that no other worker
+            # claims the same jobs
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE jobs SET state = 'failed', result = ? "
+                         "WHERE state = 'leased' AND leased_at < ? AND "
+                         "n_attempts >= ?",
+                         (pickle.dumps("The lease expired %d times, e.g. the "
+                                       "job crashed its workers"
+                                       % self.max_attempts),
+                          now - self.lease_timeout, self.max_attempts))
+            rows = conn.execute(
+                "SELECT jobs.id, jobs.search, jobs.data_key, jobs.config, "
+                "searches.incumbent FROM jobs JOIN searches "
+                "ON jobs.search = searches.search WHERE jobs.state = "
+                "'pending' OR (jobs.state = 'leased' AND jobs.leased_at < ?) "
+                "ORDER BY jobs.id LIMIT ?",
+                (now - self.lease_timeout, n)).fetchall()
+            conn.executemany("UPDATE jobs SET state = 'leased', worker = ?, "
+                             "leased_at = ?, n_attempts = n_attempts + 1 "
+                             "WHERE id = ?",
+                             [(worker, now, x[0]) for x in rows])
+        return [(job_id, search, data_key, pickle.loads(config), incumbent)
+                for job_id, search, data_key, config, incumbent in rows]
+
+    def renew(self, worker):
+        """Renew the leases of the jobs the worker is running
+        """
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET leased_at = ? WHERE worker = ? "
+                         "AND state = 'leased'", (time.time(), worker))
+
+    def complete(self, job_id, search, result):
+        """Store the result of a job, unless another worker was first
+        """
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET state = 'done', result = ? "
+                         "WHERE id = ? AND state NOT IN ('done', 'failed')",
+                         (pickle.dumps(result, pickle.HIGHEST_PROTOCOL),
+                          job_id))
+            if utils.is_candidate(result):
+                conn.execute("UPDATE searches SET incumbent = ? WHERE "
+                             "search = ? AND (incumbent IS NULL OR "
+                             "incumbent > ?)",
+                             (result.test_mse, search, result.test_mse))
+
+    def fail(self, job_id, error):
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET state = 'failed', result = ? "
+                         "WHERE id = ? AND state != 'done'",
+                         (pickle.dumps(error), job_id))
+
+    def collect(self, job_ids):
+        """Return the ids, states and results of the finished jobs among
+        `job_ids`
+        """
+        job_ids = list(job_ids)
+        rows = []
+        with self.connect() as conn:
+            for i in range(0, len(job_ids), MAX_IDS):
+                ids = job_ids[i:i + MAX_IDS]
+                rows += conn.execute(
+                    "SELECT id, state, result FROM jobs WHERE id IN (%s) "
+                    "AND state IN ('done', 'failed')" % ",".join("?" * len(ids)),
+                    ids).fetchall()
+        return [(job_id, state, pickle.loads(result))
+                for job_id, state, result in rows]
+
+
+class Master(Executor):
+
+    def __init__(self, path, lease_timeout=60., poll_interval=1.,
+                 max_pending=100):
+        """An executor that adds jobs to the queue in the SQLite file, and
+        collects the results written by the workers, see `work`
+        :param poll_interval: seconds between checks for finished jobs
+        :param max_pending: the number of jobs added and not yet finished,
+            so that configs may be proposed from the results so far
+        """
+        self.queue = JobQueue(path, lease_timeout)
+        self.poll_interval = poll_interval
+        self.max_pending = max_pending
+
+    def map(self, search, chunks):
+        self.queue.put_data(search.key, search.data)
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.update(self.queue.submit(search.key, c)
+                                   for c in chunk)
+            if exhausted and not pending:
+                return
+            finished = self.queue.collect(pending)
+            if not finished:
+                time.sleep(self.poll_interval)
+                continue
+            for job_id, state, result in finished:
+                if state == 'failed':
+                    raise Exception("Job %d failed:\n%s" % (job_id, result))
+                pending.remove(job_id)
+            yield [result for _, _, result in finished]
+
+
+def renew_leases(queue, worker_id, stop):
+    """Renew the leases of the worker until `stop` is set
+    """
+    while not stop.wait(queue.lease_timeout / 3.):
+        queue.renew(worker_id)
+
+
+def work(path, worker_id, lease_timeout=60., poll_interval=1.,
+         idle_timeout=None, bundle_time=1., run=utils.run_config,
+         max_datasets=2, max_attempts=3):
+    """Run jobs from the queue in the SQLite file
+    :param worker_id: a unique identity of the worker
+    :param idle_timeout: seconds without jobs after which the worker
+        returns, None - never
+    :param bundle_time: seconds of work to claim at once, see `cost.Bundler`
+    :param run: the function to run a config with, `utils.run_config`
+    :param max_datasets: the number of datasets to keep
+    :param max_attempts: see `JobQueue`
+    """
+    queue = JobQueue(path, lease_timeout, max_attempts)
+    bundler = cost.Bundler(bundle_time)
+    stop = threading.Event()
+    renewals = threading.Thread(target=renew_leases, daemon=True,
+                                args=(queue, worker_id, stop))
+    renewals.start()
+
+    datasets = Datasets(max_datasets)
+    idle_since = time.time()
+    try:
+        while True:
+            jobs = queue.claim(worker_id, bundler.get_size())
+            if not jobs:
+                if (idle_timeout is not None and
+                        time.time() - idle_since > idle_timeout):
+                    LOGGER.debug("%s: No jobs, exiting" % worker_id)
+                    return
+                time.sleep(poll_interval)
+                continue
+            LOGGER.debug("%s: Running %d configs" % (worker_id, len(jobs)))
+            for job_id, search, key, c, incumbent in jobs:
+                if key not in datasets:
+                    datasets.put(key, queue.get_data(key))
+                try:
+                    result = run([datasets.get(key), c, 'val', incumbent])
+                except Exception:
+                    LOGGER.exception("%s: Config %s failed" % (worker_id,
+                                                               c.vals))
+                    queue.fail(job_id, traceback.format_exc())
+                    continue
+                queue.complete(job_id, search, result)
+                bundler.observe(result)
+            idle_since = time.time()
+    finally:
+        stop.set()
+        renewals.join()
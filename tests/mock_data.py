@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
+import utils
+
 
 def get_preproc_config(lags=4, use_exog=False, deseason=False, difference=False,
                        scale=[0, 1], horizon=7, feature_selection=0,
@@ -28,6 +31,41 @@ def get_preproc_config(lags=4, use_exog=False, deseason=False, difference=False,
     return adict
 
 
+class FakeData:
+    """A dataset known only by its fingerprint
+    """
+
+    def __init__(self, key="data"):
+        self.key = key
+
+    def fingerprint(self):
+        return self.key
+
+
+def get_result(c, test_mse, num_random_seeds=1):
+    """Return a result of the learner config `c` with the train and
+    validation RMSE `test_mse` for each seed
+    """
+    x = utils.Result(c.vals)
+    for seed in range(num_random_seeds):
+        x.add_seed({'train_mse': test_mse, 'test_mse': test_mse,
+                    'train_mae': 0., 'test_mae': 0.,
+                    'train_mape': 0., 'test_mape': 0.,
+                    'yhat_is': np.array([0., 1.]),
+                    'yhat_oos': np.array([0., 1.]),
+                    'nan_fraction': 0., 'feature_scores': [],
+                    'permuted_scores': []})
+    x.calc_means()
+    return x
+
+
+def run(args):
+    """Validation RMSE equals alpha, see `utils.run_config`
+    """
+    data, c, mode, incumbent = args
+    return get_result(c, c.alpha)
+
+
 def get_date_list(days=40):
     base = datetime(2000, 1, 1)
     return [base+timedelta(days=x) for x in range(0, days)]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import cache
+import utils
+import data
+from cache import ResultCache
+from utils import prepare_data, run_config
+from learner_configs import ConfigLasso
+
+from tests.mock_data import get_df, get_preproc_config
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache", "results.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        cache.CACHES.clear()
+
+    def test_get_put(self):
+        c = ResultCache(self.path)
+        self.assertIsNone(c.get("a"))
+        c.put("a", {"test_mse": 1.0})
+        self.assertEqual(c.get("a"), {"test_mse": 1.0})
+        # persistent
+        self.assertEqual(ResultCache(self.path).get("a"), {"test_mse": 1.0})
+
+    def test_key_ignores_runtime_settings(self):
+        d = Mock()
+        d.fingerprint = Mock(return_value="data")
+        pc = get_preproc_config()
+        c = ConfigLasso({'alpha': 1.}, pc)
+        key = cache.get_key(d, c, 'val', 0)
+        c.pc = dict(pc, thread_budget="adaptive", n_cores=2,
+                    tpe_startup=5, tpe_gamma=0.5, tpe_candidates=10)
+        self.assertEqual(cache.get_key(d, c, 'val', 0), key)
+        c.pc = dict(pc, lags=pc['lags'] + 1)
+        self.assertNotEqual(cache.get_key(d, c, 'val', 0), key)
+
+    def test_connections_closed(self):
+        connections = []
+        sqlite_connect = sqlite3.connect
+
+        def connect(*args, **kwargs):
+            connections.append(sqlite_connect(*args, **kwargs))
+            return connections[-1]
+
+        with patch.object(cache.sqlite3, 'connect', side_effect=connect):
+            c = ResultCache(self.path)
+            c.put("a", 1)
+            self.assertEqual(c.get("a"), 1)
+        self.assertEqual(len(connections), 3)
+        for conn in connections:
+            self.assertRaises(sqlite3.ProgrammingError, conn.execute,
+                              "SELECT 1")
+
+    def test_lru_eviction(self):
+        c = ResultCache(self.path)
+        c.max_bytes = 2500
+        c.put("a", b"x" * 1000)
+        c.put("b", b"x" * 1000)
+        c.get("a")
+        c.put("c", b"x" * 1000)
+        # "b" was used least recently
+        self.assertIsNone(c.get("b"))
+        self.assertIsNotNone(c.get("a"))
+        self.assertIsNotNone(c.get("c"))
+
+
+class TestRunConfigCache(TestCase):
+
+    def setUp(self):
+        try:
+            reload(data)
+            reload(utils)
+        except NameError:
+            import importlib
+            importlib.reload(data)
+            importlib.reload(utils)
+        utils.pd.read_csv = Mock(return_value=get_df())
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        cache.CACHES.clear()
+
+    def test_cached_seeds(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        pc['cache_file'] = os.path.join(self.tmpdir, "results.sqlite")
+        d = prepare_data(pc)
+        r1 = run_config([d, ConfigLasso({'alpha': 0.01}, pc), 'val'])
+
+        with patch.object(ConfigLasso, 'train') as train:
+            r2 = run_config([d, ConfigLasso({'alpha': 0.01}, pc), 'val'])
+            self.assertEqual(train.call_count, 0)
+            self.assertEqual(r1.test_mse_list, r2.test_mse_list)
+
+            # a different hyperparameter value or data is not cached
+            train.side_effect = Exception("not cached")
+            with self.assertRaisesRegex(Exception, "not cached"):
+                run_config([d, ConfigLasso({'alpha': 0.1}, pc), 'val'])
+            d2 = prepare_data(get_preproc_config(lags=4, horizon=1))
+            with self.assertRaisesRegex(Exception, "not cached"):
+                run_config([d2, ConfigLasso({'alpha': 0.01}, pc), 'val'])
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from unittest import TestCase
+
+from utils import Result, add_aliases
+from learner_configs import ConfigSpace, ConfigRFR, ConfigGB, \
+    ConfigKernelRidge, ConfigSVRrbf
+
+from tests.mock_data import get_preproc_config
+
+
+class TestCanonicalConfigs(TestCase):
+
+    def test_rfr_max_features(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigRFR, {'n_estimators': [10, 20],
+                                        'max_features': [0.5, 1.0, 'auto']},
+                            pc)
+        self.assertEqual(space.num_configs, 4)
+        vals = list(space.generate_vals())
+        self.assertEqual(len(vals), 4)
+        # the first of the aliases in the grid is run
+        self.assertIn({'n_estimators': 10, 'max_features': 1.0}, vals)
+        self.assertNotIn({'n_estimators': 10, 'max_features': 'auto'}, vals)
+
+    def test_gb(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigGB, {'loss': ['ls', 'huber'],
+                                       'alpha': [0.7, 0.9],
+                                       'warm_start': [True, False]}, pc)
+        # alpha matters for huber only, warm_start never does
+        self.assertEqual(space.num_configs, 3)
+
+    def test_off_grid_canonical(self):
+        # the canonical values are not in the grid, and are not run
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigGB, {'loss': ['ls', 'huber'],
+                                       'alpha': [0.7],
+                                       'warm_start': [True]}, pc)
+        vals = list(space.generate_vals())
+        self.assertEqual(vals, [{'loss': 'ls', 'alpha': 0.7,
+                                 'warm_start': True},
+                                {'loss': 'huber', 'alpha': 0.7,
+                                 'warm_start': True}])
+
+    def test_kernel_ridge(self):
+        self.assertEqual(ConfigKernelRidge.canonical_vals(
+            {'kernel': 'linear', 'gamma': 0.1, 'degree': 2, 'coef0': 1.}),
+            {'kernel': 'linear', 'gamma': None, 'degree': 3, 'coef0': 1})
+        adict = {'kernel': 'poly', 'gamma': 0.1, 'degree': 1, 'coef0': 1.}
+        self.assertEqual(ConfigKernelRidge.canonical_vals(adict), adict)
+
+    def test_svr_rbf(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigSVRrbf, {'c': [0.1, 1.0],
+                                           'coef0': [0.0, 1.0]}, pc)
+        self.assertEqual(space.num_configs, 2)
+
+    def test_add_aliases(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigRFR, {'max_features': [0.5, 1.0, 'auto']},
+                            pc)
+        mse_scores = Counter()
+        results = {}
+        for adict in space.generate_vals():
+            x = Result(adict)
+            mse_scores[x.config_vals] = 1.
+            results[x.config_vals] = x
+
+        add_aliases(space, mse_scores, results)
+
+        self.assertEqual(len(results), 3)
+        self.assertIs(results[(('max_features', 1.0),)],
+                      results[(('max_features', 'auto'),)])
+        self.assertEqual(mse_scores[(('max_features', 1.0),)], 1.)
+
+    def test_add_aliases_off_grid(self):
+        # the grid does not contain the canonical gamma=None
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigKernelRidge, {'kernel': ['linear'],
+                                                'gamma': [0.1, 1.0]}, pc)
+        vals = list(space.generate_vals())
+        self.assertEqual(vals, [{'kernel': 'linear', 'gamma': 0.1}])
+        mse_scores = Counter()
+        results = {}
+        x = Result(vals[0])
+        mse_scores[x.config_vals] = 1.
+        results[x.config_vals] = x
+
+        add_aliases(space, mse_scores, results)
+
+        self.assertEqual(sorted(results), [(('kernel', 'linear'),
+                                            ('gamma', 0.1)),
+                                           (('kernel', 'linear'),
+                                            ('gamma', 1.0))])
+        self.assertIs(results[(('kernel', 'linear'), ('gamma', 1.0))], x)
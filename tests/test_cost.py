@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from unittest import TestCase
+from unittest.mock import Mock
+
+from utils import Result
+from cost import CostModel, CostSpace, Bundler
+from learner_configs import ConfigSpace, ConfigRFR
+
+from tests.mock_data import get_preproc_config
+
+
+def get_data(n_rows=100, n_cols=10):
+    data = Mock()
+    data.trainX = np.zeros((n_rows, n_cols))
+    return data
+
+
+class TestCostSpace(TestCase):
+
+    def get_space(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigRFR, {'n_estimators': [10, 3000, 200],
+                                        'max_depth': [5, 20]}, pc)
+        return CostSpace(space, CostModel(), get_data())
+
+    def test_longest_first(self):
+        space = self.get_space()
+        vals = [(c.vals['n_estimators'], c.vals['max_depth'])
+                for c in space.generate_config()]
+        self.assertEqual(vals, [(3000, 20), (3000, 5), (200, 20), (200, 5),
+                                (10, 20), (10, 5)])
+
+    def test_observed_runtimes(self):
+        # max_depth turns out to dominate the runtime
+        space = self.get_space()
+        for n_estimators in [10, 200, 3000]:
+            for max_depth in [5, 20]:
+                result = Result({'n_estimators': n_estimators,
+                                 'max_depth': max_depth})
+                result.test_mse_list = [1., 1.]
+                result.runtime = 2 * max_depth ** 3 * n_estimators ** 0.1
+                space.observe(result)
+        vals = [(c.vals['n_estimators'], c.vals['max_depth'])
+                for c in space.generate_config()]
+        self.assertEqual(vals[:3], [(3000, 20), (200, 20), (10, 20)])
+
+    def test_data_size(self):
+        model = CostModel()
+        vals = {'n_estimators': 10, 'max_depth': 5}
+        self.assertGreater(model.estimate(vals, get_data(1000)),
+                           model.estimate(vals, get_data(100)))
+
+
+class TestBundler(TestCase):
+
+    def observe(self, bundler, runtime):
+        result = Result({})
+        result.runtime = runtime
+        bundler.observe(result)
+
+    def test_single_until_observed(self):
+        bundler = Bundler(1.)
+        self.assertEqual(bundler.get_size(), 1)
+        self.observe(bundler, 0.01)
+        self.assertEqual(bundler.get_size(), 100)
+        self.observe(bundler, 0.5)
+        self.assertLess(bundler.get_size(), 10)
+
+    def test_bundles(self):
+        bundler = Bundler(1., max_size=4)
+        bundles = bundler.generate_bundles(range(10))
+        self.assertEqual(next(bundles), [0])
+        self.observe(bundler, 0.001)
+        self.assertEqual(list(bundles), [[1, 2, 3, 4], [5, 6, 7, 8], [9]])
+
+    def test_off(self):
+        bundler = Bundler(0)
+        self.observe(bundler, 0.001)
+        self.assertEqual([len(x) for x in bundler.generate_bundles(range(3))],
+                         [1, 1, 1])
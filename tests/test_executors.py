@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os
+import importlib
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+import data
+import utils
+import executors
+from utils import prepare_data
+from executors import (get_chunks, get_data, init_worker, get_executor,
+                       run_cached_bundle, WorkerPool, Executor,
+                       MemoryExecutor, CeleryExecutor, Datasets)
+from learner_configs import ConfigSpace, ConfigLasso
+
+from tests.mock_data import get_df, get_preproc_config, FakeData
+
+
+class TestGetChunks(TestCase):
+
+    def test_chunks(self):
+        chunks = list(get_chunks(iter(range(5)), 2))
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+
+    def test_one_per_chunk(self):
+        chunks = list(get_chunks(range(3), 1))
+        self.assertEqual(chunks, [[0], [1], [2]])
+
+
+class TestDatasets(TestCase):
+
+    def test_least_recently_used_dropped(self):
+        datasets = Datasets(2)
+        datasets.put("a", 1)
+        datasets.put("b", 2)
+        self.assertEqual(datasets.get("a"), 1)
+        datasets.put("c", 3)
+        # "b" was used least recently
+        self.assertNotIn("b", datasets)
+        self.assertIn("a", datasets)
+        self.assertIn("c", datasets)
+
+
+class TestWorkerPool(TestCase):
+
+    def test_put_data(self):
+        pool = WorkerPool(1)
+        try:
+            self.assertEqual(pool.put_data(FakeData("a")), "a")
+            init_worker(None, pool.data_dir)
+            self.assertEqual(get_data("a").key, "a")
+            pool.put_data(FakeData("b"))
+            self.assertEqual(get_data("b").key, "b")
+            # datasets are removed once no search uses them
+            pool.release_data("a")
+            self.assertEqual(os.listdir(pool.data_dir), ["b.pkl"])
+        finally:
+            pool.close()
+        self.assertFalse(os.path.exists(pool.data_dir))
+
+
+class TestMemoryExecutor(TestCase):
+
+    def test_failed_job(self):
+        # the worker cannot load a dataset that was never passed to it
+        executor = MemoryExecutor(1)
+        try:
+            search = Executor.start_search(executor, FakeData("missing"))
+            with self.assertRaisesRegex(Exception, "FileNotFoundError"):
+                list(executor.map(search, iter([[None]])))
+        finally:
+            executor.terminate()
+
+
+class FakeAsyncResult:
+
+    def __init__(self, results):
+        self.results = results
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.results
+
+
+class FakeTask:
+    """Runs jobs at once, in this process, as a Celery worker would
+    """
+
+    def __init__(self):
+        self.n_datasets_sent = 0
+
+    def delay(self, args):
+        if args[1] is not None:
+            self.n_datasets_sent += 1
+        return FakeAsyncResult(run_cached_bundle(args))
+
+
+class TestWorkerPoolThreads(TestCase):
+
+    def test_chunks_taken_by_search(self):
+        # the configs of a search are taken in its own thread, not in the
+        # dispatcher holding the lock of the pool
+        pool = WorkerPool(1)
+        threads = []
+
+        def generate_chunks():
+            for _ in range(3):
+                threads.append(threading.current_thread())
+                yield []
+
+        try:
+            search = pool.start_search(FakeData("a"))
+            results = list(pool.imap(search, generate_chunks()))
+            pool.end_search(search)
+        finally:
+            pool.close()
+        self.assertEqual(results, [[], [], []])
+        self.assertEqual(set(threads), {threading.current_thread()})
+
+
+class TestExecutors(TestCase):
+
+    def setUp(self):
+        # other tests mock parts of these modules
+        importlib.reload(data)
+        importlib.reload(utils)
+        executors.DATASETS.clear()
+        self.pc = get_preproc_config(lags=3, horizon=1)
+        with patch('utils.pd.read_csv', return_value=get_df()):
+            self.data = prepare_data(self.pc)
+
+    def get_val_results(self, name, **kwargs):
+        space = ConfigSpace(ConfigLasso, {'alpha': [0.001, 0.01, 0.1, 1.]},
+                            self.pc)
+        executor = get_executor(self.pc, name, **kwargs)
+        try:
+            return executor.get_val_results(self.data, space, self.pc)
+        finally:
+            executor.close()
+
+    def test_same_results(self):
+        expected, _ = self.get_val_results("serial")
+        self.assertEqual(len(expected), 4)
+        for name in ["thread", "process", "memory"]:
+            mse_scores, results = self.get_val_results(name, n_jobs=2)
+            self.assertEqual(sorted(mse_scores), sorted(expected))
+            for k, v in expected.items():
+                self.assertAlmostEqual(mse_scores[k], v)
+                self.assertEqual(len(results[k].test_mse_list), 3)
+
+    def test_keep_top_k(self):
+        self.pc['keep_top_k'] = 2
+        mse_scores, results = self.get_val_results("serial")
+        kept = sorted(k for k, v in results.items() if v.yhat_oos_list)
+        self.assertEqual(kept, sorted(mse_scores, key=mse_scores.get)[:2])
+        for v in results.values():
+            self.assertEqual(len(v.test_mse_list), 3)
+        space = ConfigSpace(ConfigLasso, {'alpha': [1.]}, self.pc)
+        best_config, best_result = utils.get_best_config(space, self.pc,
+                                                         mse_scores, results)
+        self.assertEqual(len(best_result.yhat_is_list), 3)
+
+    def test_default(self):
+        self.assertEqual(get_executor(self.pc).__class__.__name__,
+                         "SerialExecutor")
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(Exception, "Unknown executor"):
+            get_executor(self.pc, "mpi")
+
+    def test_celery(self):
+        # the dataset is sent once, with the job the worker could not run
+        expected, _ = self.get_val_results("serial")
+        task = FakeTask()
+        executor = CeleryExecutor(work=task)
+        space = ConfigSpace(ConfigLasso, {'alpha': [0.001, 0.01, 0.1, 1.]},
+                            self.pc)
+        mse_scores, results = executor.get_val_results(self.data, space,
+                                                       self.pc)
+        self.assertEqual(task.n_datasets_sent, 1)
+        for k, v in expected.items():
+            self.assertAlmostEqual(mse_scores[k], v)
+
+    def test_run_cached_bundle(self):
+        space = ConfigSpace(ConfigLasso, {'alpha': [0.1]}, self.pc)
+        configs = list(space.generate_config())
+        args = ["a", None, configs, 'val', None]
+        self.assertIsNone(run_cached_bundle(args))
+        self.assertEqual(len(run_cached_bundle(["a", self.data] + args[2:])),
+                         1)
+        self.assertEqual(len(run_cached_bundle(args)), 1)
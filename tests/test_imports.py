@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import subprocess
+from unittest import TestCase
+
+
+# modules loaded only when a learner or permutation importance needs them
+HEAVY_MODULES = ['tensorflow', 'skater', 'xgboost']
+# seconds; importing the modules used by the runners and the workers used to
+# take several seconds because of TensorFlow
+MAX_IMPORT_TIME = 5.0
+
+SCRIPT = """
+import sys, time, json
+start = time.time()
+import utils, learner_configs, run
+print(json.dumps({"time": time.time() - start,
+                  "heavy": [x for x in %r if x in sys.modules]}))
+"""
+
+
+class TestImports(TestCase):
+
+    def test_lazy_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.run([sys.executable, "-c", SCRIPT % HEAVY_MODULES],
+                             cwd=root, check=True, stdout=subprocess.PIPE)
+        result = json.loads(out.stdout.decode().strip().split("\n")[-1])
+        self.assertEqual(result["heavy"], [])
+        self.assertLess(result["time"], MAX_IMPORT_TIME)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from journal import Journal
+from learner_configs import ConfigSpace, ConfigLasso
+
+from tests.mock_data import get_preproc_config
+from tests.test_search import get_val_results_observed
+
+
+def get_data():
+    d = Mock()
+    d.fingerprint = Mock(return_value="data")
+    return d
+
+
+def crashing(get_val_results, n):
+    """Run `get_val_results`, crashing after `n` results
+    """
+
+    def get_crashing_val_results(d, learner_config_space, pc):
+        observe = learner_config_space.observe
+        results = []
+
+        def observe_and_crash(result):
+            if len(results) == n:
+                raise KeyboardInterrupt()
+            results.append(result)
+            observe(result)
+
+        learner_config_space.observe = observe_and_crash
+        return get_val_results(d, learner_config_space, pc)
+
+    return get_crashing_val_results
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "journal.pkl")
+        self.pc = get_preproc_config()
+        self.space = ConfigSpace(ConfigLasso, {'alpha': [1, 2, 3, 4, 5]},
+                                 self.pc)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume(self):
+        journal = Journal(self.path)
+        with self.assertRaises(KeyboardInterrupt):
+            journal.wrap(crashing(get_val_results_observed, 2))(
+                get_data(), self.space, self.pc)
+
+        evaluated = []
+
+        def run(d, learner_config_space, pc):
+            generate_config = learner_config_space.generate_config
+            learner_config_space.generate_config = lambda: (
+                evaluated.append(c.alpha) or c for c in generate_config())
+            return get_val_results_observed(d, learner_config_space, pc)
+
+        journal = Journal(self.path, resume=True)
+        mse_scores, results = journal.wrap(run)(get_data(), self.space,
+                                                self.pc)
+
+        # only the remaining configs are evaluated
+        self.assertEqual(evaluated, [3, 4, 5])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(mse_scores), 5)
+        # restored results are kept without their forecasts, and only until
+        # they are returned
+        restored = results[(('alpha', 1),)]
+        self.assertEqual(restored.yhat_oos_list, [])
+        self.assertEqual(len(results[(('alpha', 3),)].yhat_oos_list), 1)
+        self.assertEqual(journal.results, {})
+
+    def test_new_run(self):
+        journal = Journal(self.path)
+        journal.wrap(get_val_results_observed)(get_data(), self.space, self.pc)
+        self.assertTrue(os.path.exists(self.path))
+
+        # without resume, the journal is started anew
+        self.assertEqual(Journal(self.path).results, {})
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_incomplete_record(self):
+        journal = Journal(self.path)
+        journal.wrap(get_val_results_observed)(get_data(), self.space, self.pc)
+        with open(self.path, "ab") as f:
+            f.write(b"\x80\x05\x95garbage")
+
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(len(journal.results[list(journal.results)[0]]), 5)
@@ -124,3 +124,80 @@ class TestRunConfig(TestCase):
         # yhat are scaled
         self.assertTrue(r.yhat_is[0] <= 1.0)
         self.assertTrue(r.yhat_oos[0] <= 1.0)
+
+    def test_parallel_seeds(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        d = prepare_data(pc)
+        # few iterations, so that the solution depends on the random seed
+        vals = {'c': 1., 'max_iter': 5}
+        r_serial = run_config([d, ConfigLSVR(vals, pc), 'val'])
+        r_again = run_config([d, ConfigLSVR(vals, pc), 'val'])
+
+        pc_parallel = dict(pc, seed_n_jobs=3)
+        r_parallel = run_config([d, ConfigLSVR(vals, pc_parallel), 'val'])
+
+        # the same seeds give the same results
+        self.assertEqual(r_serial.test_mse_list, r_again.test_mse_list)
+        self.assertEqual(r_serial.test_mse_list, r_parallel.test_mse_list)
+        # and different seeds different results
+        self.assertEqual(len(set(r_serial.test_mse_list)), 3)
+        self.assertEqual(len(r_parallel.yhat_oos_list), 3)
+        # the shared preprocessing config is not modified by the seeds
+        self.assertIsNone(pc_parallel['random_state'])
+
+    def test_seed_config(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        c = utils.seed_config(ConfigLSVR({'c': 1.}, pc), 2)
+        self.assertEqual(c.pc['random_state'], 2)
+        self.assertIsNone(pc['random_state'])
+        self.assertEqual(c.rng.integers(100),
+                         np.random.default_rng(2).integers(100))
+
+    def test_racing_prunes_losing_config(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        pc.update(racing=1, racing_min_seeds=2)
+        d = prepare_data(pc)
+        mockConfigSVR = get_mock_svr(d, pc)
+
+        r = run_config([d, mockConfigSVR, 'val', 1e-6])
+
+        self.assertTrue(r.pruned)
+        self.assertEqual(len(r.test_mse_list), 2)
+        self.assertEqual(mockConfigSVR.train.call_count, 2)
+        self.assertFalse(utils.is_candidate(r))
+
+    def test_racing_keeps_winning_config(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        pc.update(racing=1, racing_min_seeds=2)
+        d = prepare_data(pc)
+
+        r = run_config([d, get_mock_svr(d, pc), 'val', 1e6])
+        self.assertFalse(r.pruned)
+        self.assertEqual(len(r.test_mse_list), 3)
+
+        # no racing in the test mode
+        r = run_config([d, get_mock_svr(d, pc), 'test', 1e-6])
+        self.assertFalse(r.pruned)
+        self.assertEqual(len(r.test_mse_list), 3)
+
+    def test_degenerate_exit(self):
+        pc = get_preproc_config(lags=3, horizon=1)
+        pc.update(degenerate_exit=1)
+        d = prepare_data(pc)
+        mockConfigSVR = get_mock_svr(d, pc)
+
+        r = run_config([d, mockConfigSVR, 'val'])
+
+        # the mock forecasts a constant
+        self.assertTrue(r.degenerate)
+        self.assertEqual(len(r.test_mse_list), 1)
+        self.assertEqual(mockConfigSVR.train.call_count, 1)
+        self.assertFalse(utils.is_candidate(r))
+
+    def test_is_degenerate(self):
+        pc = get_preproc_config()
+        self.assertTrue(utils.is_degenerate(np.array([.1, .1, .1]), 0.0, pc))
+        self.assertTrue(utils.is_degenerate(
+            np.array([.1, np.nan, np.nan]), 0.0, pc))
+        self.assertTrue(utils.is_degenerate(np.array([.1, .2, .3]), 0.8, pc))
+        self.assertFalse(utils.is_degenerate(np.array([.1, .2, .3]), 0.0, pc))
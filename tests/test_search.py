@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import utils
+import data
+import search
+from utils import prepare_data
+from search import get_search, subsample_train, TimeBudget
+from learner_configs import ConfigSpace, ConfigLasso, ConfigGB
+
+from tests.mock_data import get_df, get_preproc_config, get_result
+
+
+def get_val_results(d, learner_config_space, pc):
+    """Validation RMSE equals alpha, one call per rung is recorded
+    """
+    get_val_results.calls.append((learner_config_space.num_configs,
+                                  pc['num_random_seeds']))
+    mse_scores = Counter()
+    results = {}
+    for c in learner_config_space.generate_config():
+        x = get_result(c, c.alpha, pc['num_random_seeds'])
+        mse_scores[x.config_vals] = x.test_mse
+        results[x.config_vals] = x
+    return mse_scores, results
+
+
+class TestSuccessiveHalving(TestCase):
+
+    def setUp(self):
+        get_val_results.calls = []
+
+    def test_grid(self):
+        pc = get_preproc_config()
+        self.assertIs(get_search(pc, get_val_results), get_val_results)
+
+    def test_halving(self):
+        pc = get_preproc_config()
+        pc.update(search='halving', halving_eta=3, halving_rungs=3,
+                  num_random_seeds=9)
+        space = ConfigSpace(ConfigLasso, {'alpha': list(range(1, 10))}, pc)
+
+        mse_scores, results = get_search(pc, get_val_results)(None, space, pc)
+
+        # 9 configs with 1 seed, 3 with 3 seeds, 1 with 9 seeds
+        self.assertEqual(get_val_results.calls, [(9, 1), (3, 3), (1, 9)])
+        self.assertEqual(len(results), 9)
+        self.assertEqual(len(mse_scores), 9)
+        candidates = [dict(k) for k, x in results.items()
+                      if utils.is_candidate(x)]
+        self.assertEqual(candidates, [{'alpha': 1}])
+        best, result = utils.get_best_config(space, pc, mse_scores, results)
+        self.assertEqual(best.vals, {'alpha': 1})
+        self.assertEqual(len(result.test_mse_list), 9)
+
+
+class TestSubsample(TestCase):
+
+    def setUp(self):
+        utils.pd.read_csv = Mock(return_value=get_df())
+
+    def test_subsample_train(self):
+        pc = get_preproc_config(lags=3, horizon=2)
+        d = prepare_data(pc)
+        n_train = d.trainX.shape[0]
+        d_sub = subsample_train(d, 0.5)
+        n = n_train // 2
+        self.assertEqual(d_sub.trainX.shape[0], n)
+        self.assertEqual(d_sub.trainX[-1].tolist(), d.trainX[-1].tolist())
+        self.assertEqual(d_sub.trainYref.shape[0], n - pc['horizon'] + 1)
+        self.assertEqual(d_sub.trainYref[-1], d.trainYref[-1])
+        # the original data is unchanged
+        self.assertEqual(d.trainX.shape[0], n_train)
+
+
+def get_val_results_observed(d, learner_config_space, pc):
+    """Validation RMSE is the distance of alpha from 7, results are passed
+    back to the config space as they arrive
+    """
+    mse_scores = Counter()
+    results = {}
+    for c in learner_config_space.generate_config():
+        x = get_result(c, abs(c.alpha - 7.))
+        mse_scores[x.config_vals] = x.test_mse
+        results[x.config_vals] = x
+        learner_config_space.observe(x)
+    return mse_scores, results
+
+
+class TestTPE(TestCase):
+
+    def test_tpe(self):
+        pc = get_preproc_config(random_state=1)
+        pc.update(search='tpe', tpe_max_evals=15, tpe_startup=5)
+        space = ConfigSpace(ConfigLasso, {'alpha': list(range(50)),
+                                          'max_iter': [100, 1000]}, pc)
+
+        mse_scores, results = get_search(pc, get_val_results_observed)(
+            None, space, pc)
+
+        # no config is evaluated twice and the budget is respected
+        self.assertEqual(len(results), 15)
+        # model-based proposals concentrate around the optimum
+        self.assertLess(min(mse_scores.values()), 2.)
+
+    def test_tpe_exhausts_small_space(self):
+        pc = get_preproc_config(random_state=1)
+        pc.update(search='tpe', tpe_max_evals=15, tpe_startup=2)
+        space = ConfigSpace(ConfigLasso, {'alpha': [1, 2, 3]}, pc)
+
+        mse_scores, results = get_search(pc, get_val_results_observed)(
+            None, space, pc)
+        self.assertEqual(len(results), 3)
+
+    def test_tpe_runs_grid_configs(self):
+        # alpha has no effect with the "ls" loss, whose configs are run with
+        # a value from the grid rather than the canonical one
+        pc = get_preproc_config(random_state=1)
+        pc.update(search='tpe', tpe_max_evals=15, tpe_startup=2)
+        space = ConfigSpace(ConfigGB, {'loss': ['ls', 'huber'],
+                                       'alpha': [1, 2, 3]}, pc)
+
+        mse_scores, results = get_search(pc, get_val_results_observed)(
+            None, space, pc)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(dict(k)['alpha'] in [1, 2, 3] for k in results))
+
+
+class TestTimeBudget(TestCase):
+
+    def test_expired_budget(self):
+        pc = get_preproc_config()
+        space = ConfigSpace(ConfigLasso, {'alpha': [1, 2, 3]}, pc)
+        budget = TimeBudget(-1)
+
+        mse_scores, results = budget.wrap(get_val_results_observed)(
+            None, space, pc)
+
+        self.assertEqual(len(results), 0)
+        self.assertTrue(budget.expired)
+
+    def test_budget_with_halving(self):
+        pc = get_preproc_config()
+        pc.update(search='halving', halving_eta=3, halving_rungs=2)
+        space = ConfigSpace(ConfigLasso, {'alpha': list(range(1, 10))}, pc)
+        # a clock that advances by a second with every evaluated config
+        clock = [0.]
+        evaluated = []
+
+        def get_timed_val_results(d, learner_config_space, pc):
+            evaluated.append(0)
+            generate_config = learner_config_space.generate_config
+
+            def generate_timed_config():
+                for c in generate_config():
+                    evaluated[-1] += 1
+                    clock[0] += 1.
+                    yield c
+
+            learner_config_space.generate_config = generate_timed_config
+            return get_val_results(d, learner_config_space, pc)
+
+        get_val_results.calls = []
+        with patch.object(search, 'time', Mock(time=lambda: clock[0])):
+            budget = TimeBudget(4.5)
+            mse_scores, results = get_search(
+                pc, budget.wrap(get_timed_val_results))(None, space, pc)
+
+        self.assertTrue(budget.expired)
+        # the budget runs out during the first rung, and the second rung
+        # evaluates no configs
+        self.assertEqual(evaluated, [5, 0])
+        # configs that were not evaluated are missing, not pruned
+        self.assertEqual(sorted(dict(k)['alpha'] for k in results),
+                         [1, 2, 3, 4, 5])
+        self.assertEqual(len(mse_scores), 5)
+        # of the evaluated configs, the best 9 // 3 are promoted
+        pruned = sorted(dict(k)['alpha'] for k, x in results.items()
+                        if x.pruned)
+        self.assertEqual(pruned, [4, 5])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from sqlite_jobs import JobQueue, Master, work
+from learner_configs import ConfigSpace, ConfigLasso
+
+from tests.mock_data import get_preproc_config, FakeData, run
+
+
+def fail_once(args):
+    if not fail_once.done:
+        fail_once.done = True
+        raise ValueError("failed")
+    return run(args)
+
+
+class TestSQLiteJobs(TestCase):
+
+    def setUp(self):
+        self.pc = get_preproc_config()
+        self.space = ConfigSpace(ConfigLasso,
+                                 {'alpha': [1., 2., 3., 4., 5., 6.]},
+                                 self.pc)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "jobs.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def start_worker(self, worker_id, run=run):
+        worker = threading.Thread(target=work, args=(self.path, worker_id),
+                                  kwargs={'poll_interval': 0.01,
+                                          'idle_timeout': 0.5, 'run': run})
+        worker.start()
+        return worker
+
+    def test_all_configs(self):
+        master = Master(self.path, poll_interval=0.01, max_pending=4)
+        workers = [self.start_worker("w%d" % i) for i in range(2)]
+        mse_scores, results = master.get_val_results(FakeData(), self.space,
+                                                     self.pc)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(mse_scores[(('alpha', 2.),)], 2.)
+
+    def test_collect_later(self):
+        # the jobs of a master that exited are run, and a new master
+        # collects their results without running them again
+        queue = JobQueue(self.path)
+        queue.put_data("data", FakeData())
+        for c in self.space.generate_config():
+            queue.submit("data", c)
+        self.start_worker("w").join()
+        master = Master(self.path, poll_interval=0.01)
+        mse_scores, results = master.get_val_results(FakeData(), self.space,
+                                                     self.pc)
+        self.assertEqual(len(results), 6)
+
+    def test_expired_lease(self):
+        queue = JobQueue(self.path, lease_timeout=0.1)
+        c = next(self.space.generate_config())
+        job_id = queue.submit("data", c)
+        self.assertEqual([x[0] for x in queue.claim("dead")], [job_id])
+        self.assertEqual(queue.claim("alive"), [])
+        time.sleep(0.2)
+        self.assertEqual([x[0] for x in queue.claim("alive")], [job_id])
+
+    def test_max_attempts(self):
+        # a job that crashes every worker it is leased to fails
+        queue = JobQueue(self.path, lease_timeout=0.05, max_attempts=2)
+        c = next(self.space.generate_config())
+        job_id = queue.submit("data", c)
+        for worker in ["first", "second"]:
+            self.assertEqual([x[0] for x in queue.claim(worker)], [job_id])
+            time.sleep(0.1)
+        self.assertEqual(queue.claim("third"), [])
+        [(_, state, error)] = queue.collect([job_id])
+        self.assertEqual(state, 'failed')
+        self.assertIn("expired 2 times", error)
+
+    def test_crashing_job(self):
+        # workers that crash on every job: the master stops with an error
+        # instead of waiting forever
+        queue = JobQueue(self.path, lease_timeout=0.05, max_attempts=2)
+        stop = threading.Event()
+
+        def crash():
+            while not stop.wait(0.02):
+                queue.claim("crashing")
+
+        worker = threading.Thread(target=crash)
+        worker.start()
+        try:
+            master = Master(self.path, poll_interval=0.01)
+            with self.assertRaisesRegex(Exception, "expired 2 times"):
+                master.get_val_results(FakeData(), self.space, self.pc)
+        finally:
+            stop.set()
+            worker.join()
+
+    def test_incumbent(self):
+        queue = JobQueue(self.path)
+        configs = list(self.space.generate_config())
+        for c in configs:
+            queue.submit("data", c)
+        job_id, search, key, c, incumbent = queue.claim("w")[0]
+        self.assertIsNone(incumbent)
+        queue.complete(job_id, search, run([None, c, 'val', None]))
+        incumbent = queue.claim("w")[0][-1]
+        self.assertEqual(incumbent, c.alpha)
+
+    def test_failed_job(self):
+        fail_once.done = False
+        master = Master(self.path, poll_interval=0.01)
+        worker = self.start_worker("w", fail_once)
+        with self.assertRaisesRegex(Exception, "ValueError"):
+            master.get_val_results(FakeData(), self.space, self.pc)
+        worker.join()
+        # the failed job is tried again by the next master
+        worker = self.start_worker("w")
+        mse_scores, results = master.get_val_results(FakeData(), self.space,
+                                                     self.pc)
+        worker.join()
+        self.assertEqual(len(results), 6)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from threads import get_n_threads, get_env
+
+
+class TestThreadBudget(TestCase):
+
+    def test_static(self):
+        pc = {'thread_budget': 'static', 'n_cores': 16, 'n_jobs': 4,
+              'seed_n_jobs': 2}
+        self.assertEqual(get_n_threads(pc, 'Lasso'), 2)
+        self.assertEqual(get_n_threads(pc, 'RFR'), 2)
+
+    def test_adaptive(self):
+        pc = {'thread_budget': 'adaptive', 'n_cores': 16, 'n_jobs': 4}
+        self.assertEqual(get_n_threads(pc, 'Lasso'), 1)
+        self.assertEqual(get_n_threads(pc, 'XGBoost'), 4)
+
+    def test_oversubscribed(self):
+        pc = {'thread_budget': 'static', 'n_cores': 2, 'n_jobs': 4}
+        self.assertEqual(get_n_threads(pc), 1)
+
+    def test_adaptive_env(self):
+        # the variables allow the threads of the threaded learners, and are
+        # lowered for the others when they run
+        pc = {'thread_budget': 'adaptive', 'n_cores': 16, 'n_jobs': 4}
+        self.assertEqual(get_env(pc)['OMP_NUM_THREADS'], '4')
+        self.assertEqual(get_env(pc, ['KernelRidge'])['OMP_NUM_THREADS'],
+                         '4')
+        self.assertEqual(get_env(pc, ['Lasso'])['OMP_NUM_THREADS'], '1')
+
+    def test_off(self):
+        pc = {'thread_budget': None, 'n_jobs': 4}
+        self.assertIsNone(get_n_threads(pc, 'RFR'))
+        self.assertEqual(get_env(pc), {})
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+import zmq
+import numpy as np
+from unittest import TestCase
+from unittest.mock import patch
+
+import zmq_jobs
+from zmq_jobs import Master, work, dumps, loads
+from learner_configs import ConfigSpace, ConfigLasso
+
+from tests.mock_data import get_preproc_config, FakeData, run
+
+
+def run_cheap(args):
+    result = run(args)
+    result.runtime = 0.001
+    return result
+
+
+def crash(args):
+    os._exit(1)
+
+
+def hang_once(args):
+    if not hang_once.done:
+        hang_once.done = True
+        time.sleep(2)
+    return run(args)
+
+
+def run_slow(args):
+    time.sleep(0.2)
+    return run(args)
+
+
+def zombie(address, late, messages):
+    """A worker that takes a job, then sends no heartbeats, and returns the
+    result after `late` seconds; the messages it receives are recorded
+    """
+    context = zmq.Context.instance()
+    sock = context.socket(zmq.DEALER)
+    sock.identity = b"zombie"
+    sock.connect(address)
+    sock.send_multipart(dumps({"msg": "ready", "prefetch": 1}))
+    msg = loads(sock.recv_multipart(copy=False))
+    messages.append(msg)
+    time.sleep(late)
+    key, configs, mode, incumbent = msg["data"]
+    sock.send_multipart(dumps({
+        "msg": "result", "job_id": msg["job_id"], "session": msg["session"],
+        "results": [run([None, c, mode, incumbent]) for c in configs]}))
+    if sock.poll(1000):
+        messages.append(loads(sock.recv_multipart(copy=False)))
+    sock.close()
+
+
+def start_worker(address, worker_id, run=run, slim=False, persistent=False):
+    worker = threading.Thread(target=work, args=(address, worker_id),
+                              kwargs={'prefetch': 1, 'run': run,
+                                      'heartbeat_interval': 0.1,
+                                      'slim': slim, 'persistent': persistent})
+    worker.start()
+    return worker
+
+
+class TestZMQJobs(TestCase):
+
+    def setUp(self):
+        self.pc = get_preproc_config()
+        self.space = ConfigSpace(ConfigLasso,
+                                 {'alpha': [1., 2., 3., 4., 5., 6.]},
+                                 self.pc)
+
+    def run_master(self, master, workers, shutdown=False):
+        try:
+            mse_scores, results = master.get_val_results(
+                FakeData(), self.space, self.pc)
+            master.release_workers(timeout=100, shutdown=shutdown)
+            # a worker still running a job sends its result before it reads
+            # the quit message, and an inproc socket cannot send once the
+            # master is closed
+            for worker in workers:
+                worker.join()
+        finally:
+            master.close()
+        return mse_scores, results
+
+    def test_all_configs(self):
+        address = "inproc://test_all_configs"
+        master = Master(address)
+        workers = [start_worker(address, b"w%d" % i) for i in range(2)]
+        mse_scores, results = self.run_master(master, workers)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(mse_scores[(('alpha', 2.),)], 2.)
+        self.assertEqual(master.n_requeued, 0)
+
+    def test_bundles(self):
+        # after the first result, the remaining configs fit in one job
+        address = "inproc://test_bundles"
+        master = Master(address)
+        workers = [start_worker(address, b"w", run_cheap)]
+        mse_scores, results = self.run_master(master, workers)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(next(master.job_ids), 2)
+
+    def test_slim_results(self):
+        # one job at a time, in the order of the grid: alpha=2 is run after
+        # alpha=1, so it cannot be the best config
+        self.space = ConfigSpace(ConfigLasso, {'alpha': [3., 1., 2.]},
+                                 self.pc)
+        address = "inproc://test_slim_results"
+        master = Master(address)
+        workers = [start_worker(address, b"w", slim=True)]
+        mse_scores, results = self.run_master(master, workers)
+        n_forecasts = {dict(k)['alpha']: len(v.yhat_is_list)
+                       for k, v in results.items()}
+        self.assertEqual(n_forecasts, {3.: 1, 1.: 1, 2.: 0})
+
+    def test_persistent_worker(self):
+        # a worker serves two masters in turn
+        address = "ipc://%s/test_persistent_worker" % tempfile.mkdtemp()
+        worker = start_worker(address, b"w", persistent=True)
+        first = Master(address)
+        first.get_val_results(FakeData(), self.space, self.pc)
+        self.assertEqual(list(first.get_workers()), [b"w"])
+        first.release_workers(timeout=100)
+        first.close()
+        self.assertTrue(worker.is_alive())
+        second = Master(address)
+        mse_scores, results = self.run_master(second, [worker], shutdown=True)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(second.workers[b"w"]["learners"], ["ConfigLasso"])
+
+    def test_dead_worker(self):
+        # a worker process that dies on its first job
+        address = "ipc://%s/test_dead_worker" % tempfile.mkdtemp()
+        master = Master(address, heartbeat_timeout=1.)
+        dying = multiprocessing.Process(
+            target=work, args=(address, b"dying"),
+            kwargs={'prefetch': 1, 'run': crash, 'heartbeat_interval': 0.1})
+        dying.start()
+        time.sleep(0.5)
+        workers = [start_worker(address, b"healthy")]
+        mse_scores, results = self.run_master(master, workers)
+        dying.join()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(master.n_requeued, 1)
+
+    def test_late_result_of_dead_worker(self):
+        # a worker given up on returns its result while the search runs,
+        # and is not sent more jobs
+        # one config per job, so that jobs remain when the result arrives
+        self.pc['bundle_time'] = 0
+        address = "ipc://%s/test_late_result" % tempfile.mkdtemp()
+        master = Master(address, heartbeat_timeout=0.3)
+        messages = []
+        late = threading.Thread(target=zombie, args=(address, 0.6, messages))
+        late.start()
+        time.sleep(0.2)
+        workers = [start_worker(address, b"healthy", run_slow)]
+        mse_scores, results = self.run_master(master, workers)
+        late.join()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(master.n_requeued, 1)
+        self.assertEqual([x["msg"] for x in messages], ["job"])
+        self.assertNotIn(b"zombie", master.get_workers())
+
+    def test_lease_timeout(self):
+        # a worker hangs on its first job, whose result comes too late
+        address = "inproc://test_lease_timeout"
+        master = Master(address, lease_timeout=0.5)
+        hang_once.done = False
+        workers = [start_worker(address, b"slow", hang_once)]
+        time.sleep(0.2)
+        workers.append(start_worker(address, b"fast"))
+        mse_scores, results = self.run_master(master, workers)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(master.n_requeued, 1)
+
+
+class TestFrames(TestCase):
+
+    def test_zero_copy(self):
+        context = zmq.Context()
+        sender = context.socket(zmq.PAIR)
+        receiver = context.socket(zmq.PAIR)
+        sender.bind("inproc://test_zero_copy")
+        receiver.connect("inproc://test_zero_copy")
+        msg = {"large": np.arange(100000.), "small": np.ones(3)}
+        frames = dumps(msg)
+        # the large array is sent as a frame of its own
+        self.assertEqual(len(frames), 2)
+        sender.send_multipart(frames, copy=False)
+        received = loads(receiver.recv_multipart(copy=False))
+        np.testing.assert_array_equal(received["large"], msg["large"])
+        np.testing.assert_array_equal(received["small"], msg["small"])
+        sender.close()
+        receiver.close()
+        context.term()
+
+    def test_single_frame_without_protocol_5(self):
+        context = zmq.Context()
+        sender = context.socket(zmq.PAIR)
+        receiver = context.socket(zmq.PAIR)
+        sender.bind("inproc://test_single_frame")
+        receiver.connect("inproc://test_single_frame")
+        msg = {"large": np.arange(100000.)}
+        with patch.object(zmq_jobs, 'OUT_OF_BAND', False):
+            frames = dumps(msg)
+        self.assertEqual(len(frames), 1)
+        sender.send_multipart(frames, copy=False)
+        received = loads(receiver.recv_multipart(copy=False))
+        np.testing.assert_array_equal(received["large"], msg["large"])
+        sender.close()
+        receiver.close()
+        context.term()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+A budget of threads shared between the parallel workers and the threads of
+the libraries they use (BLAS/OpenMP, TensorFlow, the `n_jobs` of estimators),
+so that e.g. n_jobs worker processes each running a multi-threaded learner
+do not oversubscribe the cores. The budget is selected with the
+"thread_budget" preprocessing setting:
+
+* "static": each worker gets an equal share of the cores for every learner
+* "adaptive": each worker gets an equal share of the cores for learners that
+  use threads, see `THREADED_LEARNERS`, and one thread for the others, so
+  that e.g. Lasso or SVR do not start idle BLAS threads
+* None: libraries use their defaults
+"""
+
+import os
+import logging
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+LOGGER = logging.getLogger('main.threads')
+
+# learners that run faster with more threads: estimators with `n_jobs`,
+# TensorFlow, and KernelRidge, which spends its time in BLAS
+THREADED_LEARNERS = ['RFR', 'XGBoost', 'KNN', 'LSTM', 'KernelRidge']
+
+# environment variables read by the libraries when they start
+THREAD_ENV = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+              'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# the number of threads TensorFlow was set up with in this process
+TF_THREADS = None
+# the BLAS/OpenMP thread limit of this process
+LIMIT = None
+
+
+def get_n_cores(pc):
+    """The number of cores to share, `pc['n_cores']` or all cores
+    """
+    return pc.get('n_cores') or os.cpu_count() or 1
+
+
+def get_n_workers(pc):
+    """The number of learners running at the same time: worker processes,
+    each running `seed_n_jobs` seeds in parallel
+    """
+    return max(1, pc.get('n_jobs', 1)) * max(1, pc.get('seed_n_jobs', 1))
+
+
+def get_n_threads(pc, learner=None):
+    """Return the number of threads each learner may use, or None if the
+    budget is off
+    :param learner: the learner name, e.g. "RFR", used by the "adaptive"
+        budget
+    """
+    mode = pc.get('thread_budget')
+    if not mode:
+        return None
+    n_threads = max(1, get_n_cores(pc) // get_n_workers(pc))
+    if mode == "static":
+        return n_threads
+    elif mode == "adaptive":
+        return n_threads if learner in THREADED_LEARNERS else 1
+    raise Exception("Unknown thread budget: %s" % mode)
+
+
+def get_env(pc, learners=None):
+    """Return environment variables limiting the threads of libraries in
+    worker processes started from now on; the variables are read once, so
+    they allow the largest number of threads any of the learners may use,
+    which `limit` lowers for the others if threadpoolctl is installed
+    :param learners: the learner names the workers will run, by default any
+    """
+    if get_n_threads(pc) is None:
+        return {}
+    n_threads = max(get_n_threads(pc, x)
+                    for x in learners or THREADED_LEARNERS)
+    return {k: str(n_threads) for k in THREAD_ENV}
+
+
+def set_tensorflow_threads(n_threads):
+    """Limit the TensorFlow thread pools; they can only be set up once per
+    process, before TensorFlow runs anything
+    """
+    global TF_THREADS
+    if n_threads is None or TF_THREADS is not None:
+        return
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(
+            min(2, n_threads))
+    except RuntimeError:
+        LOGGER.debug("TensorFlow is already initialized, thread pools "
+                     "are not limited")
+    TF_THREADS = n_threads
+
+
+def limit(n_threads):
+    """Limit BLAS and OpenMP threads of this process, e.g. before training a
+    learner; the limit stays until it is changed, so seeds running in
+    parallel threads do not undo each other's limits
+    """
+    global LIMIT
+    if n_threads is None or threadpool_limits is None or n_threads == LIMIT:
+        return
+    threadpool_limits(limits=n_threads)
+    LIMIT = n_threads
@@ -7,25 +7,33 @@ Created on Mon May 21 19:03:56 2018
 @author: user
 """
 
+import sys
 import settings
+import threads
 import importlib
 import json
 import time
 import os
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 from utils import run_config_space
+from journal import Journal
 from get_logger import get_logger
 from learner_configs import ConfigSpace
+import run
 from run import get_val_results
+from executors import get_executor, get_executor_name, get_preload
 
 
 LOGGER = get_logger('main', 'logs/all-learners.log')
 START = time.time()
 TOTAL_RUNS = 0
 N_RUNS = 0
+JOURNAL = None
 
 
 def save(result):
@@ -48,16 +56,12 @@ def log_time():
 
 
 def do_one_config(LearnerConfig, learner_config_settings, preproc_config):
-    global N_RUNS
     config_space = ConfigSpace(LearnerConfig,
                                learner_config_settings,
                                preproc_config)
 
-    result = run_config_space(preproc_config, config_space,
-                              get_val_results)
-    save(result)
-    N_RUNS += 1
-    log_time()
+    return run_config_space(preproc_config, config_space,
+                            get_val_results, journal=JOURNAL)
 
 
 def get_learner_config(learner):
@@ -71,17 +75,20 @@ def get_learner_config(learner):
     # set up parameter space for the learning method
     LearnerConfig = getattr(importlib.import_module("learner_configs"),
                            "Config%s" % learner)
-    learner_config_settings = settings.__dict__[learner]
+    learner_config_settings = dict(settings.__dict__[learner])
 
     if learner == "LSTM":
         learner_config_settings["bidirectional"] = bidirectional
     return LearnerConfig, learner_config_settings
 
 
-def do_one_learner(learner):
+def get_variants(learner):
+    """Yield the learner config and the preprocessing config for every step
+    of the sweep for a learner
+    """
 
     # parameters of data preprocessing
-    preproc_config = settings.PREPROCESSING
+    preproc_config = dict(settings.PREPROCESSING)
 
     LearnerConfig, learner_config_settings = get_learner_config(learner)
 
@@ -98,7 +105,6 @@ def do_one_learner(learner):
     preproc_config['date_format'] = '%d/%m/%Y'
 
     for data_file in data_files:
-        print(data_file)
         preproc_config['data_file'] = data_file
 
         for rfe_step in rfe_steps:
@@ -112,24 +118,63 @@ def do_one_learner(learner):
                 # baseline
                 preproc_config['use_exog'] = 0
                 preproc_config['feature_selection'] = 0
-                do_one_config(LearnerConfig, learner_config_settings,
-                              preproc_config)
+                yield (LearnerConfig, learner_config_settings,
+                       dict(preproc_config))
 
                 # exogenous: feature selection
                 preproc_config['use_exog'] = 1
                 for n_features in n_features_settings:
                     preproc_config['feature_selection'] = n_features
-                    do_one_config(LearnerConfig, learner_config_settings,
-                                  preproc_config)
+                    yield (LearnerConfig, learner_config_settings,
+                           dict(preproc_config))
 
 
 def main():
+    global JOURNAL, TOTAL_RUNS, N_RUNS
+    # journal of completed configs, to resume an interrupted run
+    JOURNAL = Journal('logs/journal_all-learners.pkl',
+                      resume='--resume' in sys.argv[1:])
     # ['AdaBoost', 'GB', 'RFR', 'LSTM', 'BiLSTM', 'XGBoost', 'Lasso',
     # 'LSVR', 'SVRrbf', 'SVRsigmoid', 'SVRpoly', 'KNN', 'ElasticNet',
     # 'KernelRidge']
     learners = ['RFR']
-    for learner in learners:
-        do_one_learner(learner)
+    variants = [x for learner in learners for x in get_variants(learner)]
+    TOTAL_RUNS = len(variants)
+
+    # the sweep steps of all learners run as concurrent searches on one pool
+    # of warm workers, which takes the most expensive configs of all of them
+    # first, so that the pool does not drain between the steps
+    pc = settings.PREPROCESSING
+    name = get_executor_name(pc)
+    n_searches = 1
+    if name != 'serial':
+        n_searches = pc.get('concurrent_searches', 1)
+        if pc['n_jobs'] > 1:
+            # library threads of the workers, see `threads.py`
+            os.environ.update(threads.get_env(pc, learners))
+        kwargs = {'max_searches': n_searches} if name == 'process' else {}
+        run.EXECUTOR = get_executor(pc, name, preload=get_preload(learners),
+                                    **kwargs)
+        if not run.EXECUTOR.concurrent:
+            n_searches = 1
+    executor = ThreadPoolExecutor(n_searches)
+    futures = []
+    try:
+        futures = [executor.submit(do_one_config, *x) for x in variants]
+        for future in as_completed(futures):
+            save(future.result())
+            N_RUNS += 1
+            log_time()
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        if run.EXECUTOR is not None:
+            run.EXECUTOR.terminate()
+        raise
+    executor.shutdown()
+    if run.EXECUTOR is not None:
+        run.EXECUTOR.close()
 
 
 if __name__ == "__main__":
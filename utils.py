@@ -1,16 +1,23 @@
+import time
+import heapq
 import logging
+import itertools
 import warnings
 
+from copy import copy
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 from scipy.ndimage.interpolation import shift
+from scipy.stats import t as student_t
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 
-from skater.core.explanations import Interpretation
-from skater.model import InMemoryModel
-
+import cache
+import cost
+import search
+import threads
 from data import Data2d, Data3d
 
 
@@ -32,6 +39,21 @@ class Result:
         self.yhat_oos_list = []
         self.feature_scores_list = []
         self.permuted_scores_list = []
+        self.nan_fraction_list = []
+
+        # set if the remaining seeds were abandoned by racing
+        self.pruned = False
+        # set if forecasts were constant or mostly NaN after the first seed
+        self.degenerate = False
+        # wall-clock seconds taken by all seeds
+        self.runtime = None
+
+    def add_seed(self, seed_result):
+        """Append the scores and forecasts obtained with one random seed
+        :param seed_result: a dictionary returned by `run_seed`
+        """
+        for k, v in seed_result.items():
+            getattr(self, k + "_list").append(v)
 
     def get_mean(self, alist):
         a = np.array(alist)
@@ -72,16 +94,22 @@ def interpolate(df):
     return df
 
 
-def sort_feature_scores(data, scores):
+def sort_feature_scores(data, scores, feature_names=None):
+    if feature_names is None:
+        feature_names = data.feature_names
     scores = np.array(scores).flatten()
-    assert len(data.feature_names) == len(scores)
-    return Counter(dict((x, y) for x, y in zip(data.feature_names, scores))
+    assert len(feature_names) == len(scores)
+    return Counter(dict((x, y) for x, y in zip(feature_names, scores))
                             ).most_common()
 
 
 def get_permuted_feature_scores(model, data):
     """Computed permuted feature importances, using skater
     """
+    # skater is slow to import and only needed here
+    from skater.core.explanations import Interpretation
+    from skater.model import InMemoryModel
+
     interpreter = Interpretation(data.testX, feature_names=data.feature_names)
     pyint_model = InMemoryModel(model.predict, examples=data.testX)
     feature_scores = list(interpreter.feature_importance.feature_importance(
@@ -102,72 +130,280 @@ def get_feature_scores(model, data):
         return None
 
     features = get_features_by_attr(model)
+    feature_names = None
     if features is None:
         if hasattr(model, 'rankings_'):
             features = sort_feature_scores(data, -model.rankings_)
         elif hasattr(model, 'estimator_'):
             features = get_features_by_attr(model.estimator_)
-            # update remaining feature names
-            data.feature_names = [data.feature_names_orig[x]
-                                  for x in model.get_support(indices=True)]
+            # remaining feature names, kept local instead of updating
+            # data.feature_names as seeds may run concurrently on the data
+            feature_names = [data.feature_names_orig[x]
+                             for x in model.get_support(indices=True)]
+
+    return sort_feature_scores(data, features, feature_names) \
+        if features else []
+
+
+def get_seeds(pc):
+    """Return the random seeds to evaluate a config with
+    :param pc: preprocessing config
+    """
+    # if num_random_seeds == 0 (i.e., the function is then used by
+    # emp_intervals_viz.py), then use the passed random state, don't change it
+    if pc['num_random_seeds'] == 0:
+        return [pc['random_state']]
+    return list(range(pc['num_random_seeds']))
+
+
+def seed_config(c, seed):
+    """Return a copy of the learner config bound to one random seed, with its
+    own copy of the preprocessing config and its own random generator, so that
+    seeds can run concurrently
+    """
+    c = copy(c)
+    c.pc = dict(c.pc, random_state=seed)
+    c.rng = np.random.default_rng(seed)
+    c.n_threads = threads.get_n_threads(
+        c.pc, c.__class__.__name__.replace("Config", ""))
+    if getattr(c, 'poly_features', None) is not None:
+        c.poly_features = copy(c.poly_features)
+    return c
+
+
+def run_seed(args):
+    """Train and evaluate a learner config with one random seed
+    :param args: data, learner config, mode ('test' or 'val'), seed
+    :return: a dictionary with scores and forecasts, see `Result.add_seed`
+    """
+    data, c, mode, seed = args
+
+    # without a seed, results are not reproducible and are not cached
+    result_cache = cache.get_cache(c.pc) if seed is not None else None
+    if result_cache is not None:
+        key = cache.get_key(data, c, mode, seed)
+        seed_result = result_cache.get(key)
+        if seed_result is not None:
+            LOGGER.debug(f"{c.name} seed {seed}: using the cached result")
+            return seed_result
+
+    c = seed_config(c, seed)
+    threads.limit(c.n_threads)
+
+    model = c.train(data)
+
+    # in-sample
+    yhat_is = c.forecast(model, data.trainX)
+    mse_train = get_mse(data, yhat_is, "train")
+
+    # out-of-sample
+    yhat_oos = c.forecast(model, data.testX) if mode == 'test' \
+        else c.forecast(model, data.valX)
+    nan_fraction = getattr(c, 'nan_fraction', 0.0)
+    mse_val = get_mse(data, yhat_oos, mode)
+    LOGGER.info(f"{c.name} train mse {mse_train} val mse {mse_val}")
+
+    if c.pc['poly_degree'] == 0:
+        feature_scores = get_feature_scores(model, data)
+    else:
+        feature_scores = []
+    permuted_scores = []#get_permuted_feature_scores(model, data)
+
+    seed_result = {
+        'train_mse': mse_train,
+        'train_mae': get_mae(data, yhat_is, "train"),
+        'train_mape': get_mape(data, yhat_is, "train"),
+        'yhat_is': yhat_is,
+        'test_mse': mse_val,
+        'test_mae': get_mae(data, yhat_oos, mode),
+        'test_mape': get_mape(data, yhat_oos, mode),
+        'yhat_oos': yhat_oos,
+        'nan_fraction': nan_fraction,
+        'feature_scores': feature_scores,
+        'permuted_scores': permuted_scores
+    }
+    if result_cache is not None:
+        result_cache.put(key, seed_result)
+
+    return seed_result
+
+
+def map_seeds(tasks, pc):
+    """Yield results of `run_seed` in the order of `tasks`, running them on
+    a pool of `pc['seed_n_jobs']` threads or processes (`pc['seed_executor']`).
+    Seeds that have not started yet are cancelled when the generator is closed.
+    :param pc: preprocessing config
+    """
+    n_jobs = pc.get('seed_n_jobs', 1)
+    if n_jobs == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield run_seed(task)
+        return
+
+    Executor = ProcessPoolExecutor if pc.get('seed_executor') == 'process' \
+        else ThreadPoolExecutor
+    executor = Executor(min(n_jobs, len(tasks)))
+    futures = [executor.submit(run_seed, task) for task in tasks]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def is_degenerate(yhat, nan_fraction, pc):
+    """Check if forecasts are constant or mostly NaN, e.g. due to a huge
+    regularization or an LSTM collapsing to the mean
+    :param nan_fraction: the share of NaN predictions already replaced by
+        `Config.forecast`
+    :param pc: preprocessing config
+    """
+    yhat = np.asarray(yhat, dtype=float).ravel()
+    nans = np.isnan(yhat)
+    if max(nan_fraction, nans.mean()) > pc.get('max_nan_fraction', 0.5):
+        return True
+    yhat = yhat[~nans]
+    return yhat.size == 0 or np.all(yhat == yhat[0])
 
-    return sort_feature_scores(data, features) if features else []
+
+def get_incumbent_value(incumbent):
+    """Return the validation RMSE of the incumbent, which may be passed either
+    as a number or as a shared `multiprocessing.Value`
+    """
+    value = getattr(incumbent, 'value', incumbent)
+    if value is None or not np.isfinite(value):
+        return None
+    return value
+
+
+def is_losing(result, incumbent, pc):
+    """Racing: check if the config is clearly worse than the incumbent, i.e.
+    the lower confidence bound of its mean validation RMSE so far is above
+    the incumbent's RMSE
+    :param pc: preprocessing config
+    """
+    incumbent = get_incumbent_value(incumbent)
+    n = len(result.test_mse_list)
+    if incumbent is None or n < max(2, pc.get('racing_min_seeds', 3)):
+        return False
+    scores = np.array(result.test_mse_list)
+    margin = student_t.ppf(pc.get('racing_confidence', 0.95), n - 1) * \
+        scores.std(ddof=1) / np.sqrt(n)
+    return scores.mean() - margin > incumbent
 
 
 def run_config(args):
     """
     :param c: learner config
     :param mode: 'test' or 'val'
+    :param incumbent: optional, the best validation RMSE so far, used for
+        racing (see `is_losing`)
     """
-    data, c, mode = args
+    data, c, mode = args[:3]
+    incumbent = args[3] if len(args) > 3 else None
+    racing = mode == 'val' and c.pc.get('racing', 0)
+    degenerate_exit = mode == 'val' and c.pc.get('degenerate_exit', 0)
 
     result = Result(c.vals)
-
-    # if num_random_seeds == 0 (i.e., the function is then used by
-    # emp_intervals_viz.py), then use the passed random state, don't change it
-    if c.pc['num_random_seeds'] == 0:
-        iter_range = range(c.pc['random_state'], c.pc['random_state']+1)
-    else:
-        iter_range = range(c.pc['num_random_seeds'])
-
-    for seed_number in iter_range:
-
-        np.random.seed(seed_number)
-        c.pc['random_state'] = seed_number
-        model = c.train(data)
-
-        # in-sample
-        yhat_is = c.forecast(model, data.trainX)
-        mse_train = get_mse(data, yhat_is, "train")
-        result.train_mse_list.append(mse_train)
-        result.train_mae_list.append(get_mae(data, yhat_is, "train"))
-        result.train_mape_list.append(get_mape(data, yhat_is, "train"))
-        result.yhat_is_list.append(yhat_is)
-
-        # out-of-sample
-        yhat_oos = c.forecast(model, data.testX) if mode == 'test' \
-            else c.forecast(model, data.valX)
-
-        mse_val = get_mse(data, yhat_oos, mode)
-        LOGGER.info(f"{c.name} train mse {mse_train} val mse {mse_val}")
-        result.test_mse_list.append(mse_val)
-        result.test_mae_list.append(get_mae(data, yhat_oos, mode))
-        result.test_mape_list.append(get_mape(data, yhat_oos, mode))
-        result.yhat_oos_list.append(yhat_oos)
-
-        if c.pc['poly_degree'] == 0:
-            feature_scores = get_feature_scores(model, data)
-        else:
-            feature_scores = []
-        permuted_scores = []#get_permuted_feature_scores(model, data)
-        result.feature_scores_list.append(feature_scores)
-        result.permuted_scores_list.append(permuted_scores)
+    start = time.time()
+
+    tasks = [(data, c, mode, seed) for seed in get_seeds(c.pc)]
+    seed_results = map_seeds(tasks, c.pc)
+    for seed_result in seed_results:
+        result.add_seed(seed_result)
+        if (degenerate_exit and len(result.test_mse_list) == 1 and
+                is_degenerate(seed_result['yhat_oos'],
+                              seed_result['nan_fraction'], c.pc)):
+            LOGGER.info("%s: constant or NaN forecasts, skipping the "
+                        "remaining seeds" % c.name)
+            result.degenerate = True
+            seed_results.close()
+            break
+        if (racing and len(result.test_mse_list) < len(tasks) and
+                is_losing(result, incumbent, c.pc)):
+            LOGGER.info("%s: pruned after %d seeds" % (
+                c.name, len(result.test_mse_list)))
+            result.pruned = True
+            seed_results.close()
+            break
+    result.runtime = time.time() - start
 
     result.calc_means()
 
     return result
 
 
+def slim_result(result):
+    """Drop the in-sample forecasts of a validation result, which cover the
+    whole training set and make up most of its size, e.g. before sending it
+    to the master; they are restored for the best config, see
+    `run_config_space`
+    """
+    result.yhat_is_list = []
+    result.yhat_is = None
+    return result
+
+
+def strip_forecasts(result):
+    """Drop the forecasts of the seeds of a validation result, keeping its
+    scores and the mean validation forecast, see `TopResults`
+    """
+    slim_result(result)
+    result.yhat_oos_list = []
+    return result
+
+
+class TopResults:
+
+    def __init__(self, k):
+        """Keeps the forecasts of the `k` candidate results with the lowest
+        validation RMSE, see `is_candidate`, and drops them from the other
+        results as they arrive, so that a search over thousands of configs
+        does not hold the forecasts of every seed of every config
+        :param k: the number of results to keep the forecasts of, 0 - all
+        """
+        self.k = k
+        # the kept results, the highest validation RMSE first
+        self.heap = []
+        self.order = itertools.count()
+
+    def add(self, result):
+        if not self.k:
+            return
+        if not is_candidate(result):
+            strip_forecasts(result)
+            return
+        # of equal RMSEs, the earlier result is dropped first, as the later
+        # one is selected by `get_best_config`
+        x = (-result.test_mse, next(self.order), result)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, x)
+        else:
+            strip_forecasts(heapq.heappushpop(self.heap, x)[2])
+
+
+def run_bundle(args, run=run_config):
+    """Run several configs on the same data, e.g. a bundle of cheap configs
+    sent to a distributed worker as one job, see `cost.Bundler`
+    :param args: data, a list of configs, mode and optionally the incumbent
+    :param run: the function to run one config with
+    :return: a list of results
+    """
+    data, configs, mode = args[:3]
+    incumbent = args[3] if len(args) > 3 else None
+    results = []
+    for c in configs:
+        result = run([data, c, mode, incumbent])
+        results.append(result)
+        # later configs of the bundle race against the results of earlier
+        if (mode == 'val' and is_candidate(result) and
+                (incumbent is None or result.test_mse < incumbent)):
+            incumbent = result.test_mse
+    return results
+
+
 def get_mse(data, yhat, mode="train"):
     """Root Mean Squared Error
     """
@@ -266,14 +502,40 @@ def do_baseline(d):
     return
 
 
+def add_aliases(learner_config_space, mse_scores, results):
+    """Share the results of each evaluated config with the configs resulting
+    in the same model, see `Config.canonical_vals`
+    """
+    for k, x in list(results.items()):
+        for alias in learner_config_space.get_aliases(k):
+            if alias not in results:
+                mse_scores[alias] = mse_scores[k]
+                results[alias] = x
+
+
+def is_candidate(result):
+    """Check if a validation result can be selected as the best config
+    """
+    # configs abandoned by racing or the degenerate forecasts check were not
+    # evaluated on all seeds
+    if result.pruned or result.degenerate:
+        return False
+    # if all predictions are all the same
+    if result.yhat_oos[0] == result.yhat_oos.mean():
+        return False
+    return True
+
+
 def get_best_config(learner_config_space, preproc_config, mse_scores, results):
     LOGGER.debug("Validation set results:")
     best_config = None
     best_result = None
-    for k, v in list(reversed(mse_scores.most_common()))[:10]:
-        LOGGER.debug("%s:\t%s" % (k, v))
-        # if all predictions are all the same
-        if results[k].yhat_oos[0] == results[k].yhat_oos.mean():
+    for i, (k, v) in enumerate(reversed(mse_scores.most_common())):
+        if best_config is not None and i >= 10:
+            break
+        if i < 10:
+            LOGGER.debug("%s:\t%s" % (k, v))
+        if not is_candidate(results[k]):
             continue
         if best_config is None:
             best_config = learner_config_space.Config(dict(k), preproc_config)
@@ -281,26 +543,64 @@ def get_best_config(learner_config_space, preproc_config, mse_scores, results):
     return best_config, best_result
 
 
-def run_config_space(pc, learner_config_space, get_val_results, baseline=False):
+def run_config_space(pc, learner_config_space, get_val_results, baseline=False,
+                     time_budget=None, journal=None):
     """Run experiments with all possible settings in the config space
     :param pc: preprocessing config
     :param get_val_results: a function to run cross-validation on the
-        validattion set, e.g. see example in `run.py`
+        validattion set, e.g. see example in `run.py`; it is wrapped with the
+        search strategy selected by `pc['search']`, see `search.py`
+    :param time_budget: seconds after which no more configs are scheduled,
+        by default `pc['time_budget']`, 0 - no limit; the best config found
+        so far is then returned, marked as partial
+    :param journal: a `journal.Journal` to record the results in as they
+        arrive, and to restore the results of completed configs from
     """
+    if time_budget is None:
+        time_budget = pc.get('time_budget', 0)
 
     # load data
     data = prepare_data(pc, dim=learner_config_space.dim)
+    # hash the data once, rather than in every worker
+    data.fingerprint()
 
     if baseline:
         do_baseline(data)
         return
 
     # search for best parameters on the validation set
+    if journal is not None:
+        get_val_results = journal.wrap(get_val_results)
+    budget = search.TimeBudget(time_budget) if time_budget else None
+    if budget is not None:
+        get_val_results = budget.wrap(get_val_results)
+    if pc.get('longest_first', 1):
+        get_val_results = cost.longest_first(get_val_results)
+    get_val_results = search.get_search(pc, get_val_results)
     mse_scores, val_results = get_val_results(data, learner_config_space, pc)
+    partial = budget is not None and budget.expired
+    coverage = len(val_results) / learner_config_space.num_configs
+    if partial:
+        LOGGER.info("Partial results: evaluated %d of %d configs" % (
+            len(val_results), learner_config_space.num_configs))
+    add_aliases(learner_config_space, mse_scores, val_results)
 
     # select the best config according to validation set results
     best_config, val_result = get_best_config(learner_config_space, pc,
                                                mse_scores, val_results)
+    if best_config is None:
+        raise Exception("No config could be selected, %d configs evaluated"
+                        % len(val_results))
+
+    if not val_result.yhat_is_list or not val_result.yhat_oos_list:
+        # the forecasts were dropped by a distributed worker or by
+        # `TopResults`, see `slim_result`; run the best config again to
+        # obtain them
+        LOGGER.info("Computing forecasts of the best config")
+        full_result = run_config([data, best_config, 'val'])
+        val_result.yhat_is_list = full_result.yhat_is_list
+        val_result.yhat_is = full_result.yhat_is
+        val_result.yhat_oos_list = full_result.yhat_oos_list
 
     yhat_is = data.revert(val_result.yhat_is, "train", True)
     yhat_val = data.revert(val_result.yhat_oos, "val", True)
@@ -324,6 +624,8 @@ def run_config_space(pc, learner_config_space, get_val_results, baseline=False):
                 'preproc_config': pc,
                 'learner': best_config.learner,
                 'best_learner_config': best_config.vals,
+                'partial': partial,
+                'coverage': coverage,
                 'mse': {
                         'train': {
                             'mean': val_result.train_mse,
@@ -371,7 +673,9 @@ def run_config_space(pc, learner_config_space, get_val_results, baseline=False):
                 'validation_runs': [{'config': dict(x),
                                      'scores': {'mse': v.test_mse,
                                                 'mae': v.test_mae,
-                                                'mape': v.test_mape}}
+                                                'mape': v.test_mape},
+                                     'pruned': v.pruned,
+                                     'degenerate': v.degenerate}
                                         for x, v in val_results.items()],
                 'feature_scores': val_result.feature_scores,
                 'permuted_scores': val_result.permuted_scores
@@ -15,11 +15,12 @@ celery -A workers_celery purge
 
 import sys
 import os
+import time
 import celery
 import logging
 os.environ["FORKED_BY_MULTIPROCESSING"] = "1"
 
-from utils import run_config
+from executors import init_worker, run_cached_bundle
 
 
 app = celery.Celery('workers_celery', broker='amqp://localhost//')
@@ -27,14 +28,23 @@ app.config_from_object('celeryconfig')
 
 logging.getLogger("matplotlib").disabled = True
 
+# keep the datasets of two searches, e.g. with concurrent_searches
+init_worker(None, max_datasets=2)
+
 
 @app.task
 def work(x):
+    """Run a bundle of configs on a dataset kept by the worker process, see
+    `executors.run_cached_bundle`
+    """
     start = time.time()
-    print("Running config", file=sys.stderr)
-    result = run_config(x)
+    print("Running %d configs" % len(x[2]), file=sys.stderr)
+    results = run_cached_bundle(x)
+    if results is None:
+        print("Dataset %s not loaded, asking for it" % x[0], file=sys.stderr)
+        return None
     m, s = divmod(time.time()-start, 60)
     h, m = divmod(m, 60)
-    print("Result: %s, took %d:%02d:%02d" % (result, h, m, s),
+    print("Results: %s, took %d:%02d:%02d" % (results, h, m, s),
           file=sys.stderr)
-    return result
+    return results
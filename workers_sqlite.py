@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Usage:
+
+python workers_sqlite.py [QUEUE_FILE]
+
+Starts `n_jobs` workers that run jobs from the queue in the SQLite file, by
+default `settings.SQLITE["queue_file"]`, see `sqlite_jobs.py`. Workers run
+jobs for any learner, and may be started on any machine that can open the
+file, before or after the master.
+"""
+
+import os
+import sys
+import socket
+from multiprocessing import Process
+
+import settings
+from get_logger import get_logger
+from sqlite_jobs import work
+
+
+path = sys.argv[1] if len(sys.argv) > 1 else settings.SQLITE["queue_file"]
+LOGGER = get_logger('main', 'logs/workers_sqlite.log')
+
+
+def slave(worker_id):
+
+    import logging
+    logging.getLogger("matplotlib").disabled = True
+
+    # a unique identity, to renew the leases of the worker's jobs
+    worker_id = "%s-%d-%d" % (socket.gethostname(), os.getpid(), worker_id)
+    work(path, worker_id, lease_timeout=settings.SQLITE["lease_timeout"],
+         poll_interval=settings.SQLITE["poll_interval"],
+         idle_timeout=settings.SQLITE["idle_timeout"],
+         max_attempts=settings.SQLITE["max_attempts"],
+         bundle_time=settings.PREPROCESSING.get("bundle_time", 1))
+
+
+if __name__ == "__main__":
+
+    # Create a pool of workers to distribute work to
+    for _id in range(settings.PREPROCESSING['n_jobs']):
+        Process(target=slave, args=(_id,)).start()
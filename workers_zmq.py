@@ -5,20 +5,32 @@ Created on Sat Jun  9 22:28:44 2018
 Based on http://mdup.fr/blog/easy-cluster-parallelization-with-zeromq
 
 @author: vpekar
+
+Usage:
+
+python workers_zmq.py [LEARNER] [--persistent]
+
+Workers run jobs for any learner; the learner name only names the log file.
+With --persistent, or without a learner name, the workers stay connected when
+the master quits, and serve the next master, e.g. the next learner or sweep
+step, without importing TensorFlow and other libraries again.
 """
 
+import os
 import sys
-import zmq
+import socket
 from multiprocessing import Process
 
 import settings
 from get_logger import get_logger
-from utils import run_config
+from zmq_jobs import work
 
 
-learner = sys.argv[1]
-assert learner in settings.__dict__
-LOGGER = get_logger('main', 'logs/workers_zmq_%s.log' % learner)
+args = [x for x in sys.argv[1:] if not x.startswith("--")]
+learner = args[0] if args else None
+assert learner is None or learner in settings.__dict__
+persistent = learner is None or "--persistent" in sys.argv[1:]
+LOGGER = get_logger('main', 'logs/workers_zmq_%s.log' % (learner or "all"))
 
 
 def slave(worker_id):
@@ -26,33 +38,12 @@ def slave(worker_id):
     import logging
     logging.getLogger("matplotlib").disabled = True
 
-    # Setup ZMQ.
-    context = zmq.Context()
-    sock = context.socket(zmq.REQ)
-    sock.connect(settings.ZMQ["master_address"])
-
-    while True:
-
-        LOGGER.debug("%s: Available" % worker_id)
-        sock.send_pyobj({"msg": "available"})
-
-        # Retrieve work and run the computation.
-        job = sock.recv_pyobj()
-        if job.get("msg") == "quit":
-            LOGGER.debug("%s: Received a quit msg, exiting" % worker_id)
-            break
-
-        LOGGER.debug("%s: Running config %s" % (worker_id, job["data"][1]))
-        result = run_config(job["data"])
-
-        LOGGER.debug("%s: Sending result back" % worker_id)
-        sock.send_pyobj({"msg": "result", "result": result})
-        LOGGER.debug("%s: Done sending result" % worker_id)
-
-        msg = sock.recv()
-        if msg == b"quit":
-            LOGGER.debug("%s Received msg %s" % (worker_id, msg))
-            break
+    # a unique identity, so that the master can tell the workers apart
+    worker_id = "%s-%d-%d" % (socket.gethostname(), os.getpid(), worker_id)
+    work(settings.ZMQ["master_address"], worker_id.encode(),
+         prefetch=settings.ZMQ["prefetch"],
+         heartbeat_interval=settings.ZMQ["heartbeat_interval"],
+         slim=settings.ZMQ["slim_results"], persistent=persistent)
 
 
 if __name__ == "__main__":
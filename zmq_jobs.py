@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+The ZeroMQ protocol between the master (`run_zmq.py`) and the workers
+(`workers_zmq.py`).
+
+The master binds a ROUTER socket, and each worker connects a DEALER socket
+and announces itself with a "ready" message. The master keeps up to
+`prefetch` jobs queued at each worker, and every result returns a slot.
+Jobs carry the fingerprint of the dataset, and a worker requests the dataset
+only when it does not have it yet. A job is a bundle of configs sized to take
+about `bundle_time` seconds, see `cost.Bundler`, and the worker returns a list
+of results.
+
+Messages are pickled with protocol 5, and large NumPy arrays, e.g. the
+forecasts in results and the dataset, are sent as separate frames, so that
+they are not copied into the message on either end. Before Python 3.8, which
+added protocol 5, messages are pickled with protocol 4 into one frame. With `slim`, workers
+leave out the in-sample forecasts of results that cannot be the best config,
+see `utils.slim_result`.
+
+Workers send heartbeats from a separate thread, so that they are heard from
+while running a long job. A job is leased to the worker it is sent to: when a
+worker is not heard from for `heartbeat_timeout` seconds, or a job takes
+longer than `lease_timeout` seconds, the job is sent to another worker, and a
+late result of the first attempt is ignored.
+
+Workers serve any learner, as jobs carry their config objects, and learner
+modules import their libraries when first used. A `persistent` worker stays
+connected when a master quits and serves the next master to bind the same
+address: the master tells a worker it has not heard from before, judging by
+its heartbeats, to announce itself again. Jobs and results carry the session
+of the master, so that a result for a previous master is ignored.
+"""
+
+import os
+import sys
+import time
+import uuid
+import pickle
+import socket
+import logging
+import itertools
+import threading
+
+from collections import deque
+
+import zmq
+
+import utils
+from executors import Executor, Datasets
+
+
+LOGGER = logging.getLogger('main.zmq_jobs')
+
+# how often the master checks the leases when no messages arrive, ms
+POLL_INTERVAL = 500
+# arrays smaller than this many bytes are pickled into the message rather
+# than sent as separate frames, as ZMQ copies small frames anyway
+MIN_FRAME_SIZE = 2 ** 16
+# whether pickle can send buffers out of band, i.e. has protocol 5
+OUT_OF_BAND = sys.version_info >= (3, 8)
+
+
+def dumps(msg):
+    """Pickle a message into frames: the pickle, then the buffers of large
+    arrays, which ZMQ sends without copying
+    """
+    if not OUT_OF_BAND:
+        return [pickle.dumps(msg, 4)]
+    buffers = []
+
+    def add_buffer(buf):
+        # a false value sends the buffer out of band
+        if buf.raw().nbytes < MIN_FRAME_SIZE:
+            return True
+        buffers.append(buf.raw())
+        return False
+
+    return [pickle.dumps(msg, 5, buffer_callback=add_buffer)] + buffers
+
+
+def loads(frames):
+    """Unpickle a message received as `zmq.Frame`s; the arrays use the memory
+    of the frames
+    """
+    if len(frames) == 1:
+        return pickle.loads(frames[0].buffer)
+    return pickle.loads(frames[0].buffer,
+                        buffers=[x.buffer for x in frames[1:]])
+
+
+class Lease:
+
+    def __init__(self, worker, job):
+        """A job sent to a worker, and when it was sent
+        """
+        self.worker = worker
+        self.job = job
+        self.start = time.time()
+
+
+class Master(Executor):
+
+    bundle = True
+    # the master has one socket, used by one search at a time
+    concurrent = False
+
+    def __init__(self, address, context=None, heartbeat_timeout=10.,
+                 lease_timeout=0):
+        """An executor that runs jobs on the workers connected with `work`
+        :param address: the address to bind, e.g. "tcp://*:5557"
+        :param heartbeat_timeout: seconds after which a silent worker is
+            considered dead, and its jobs are sent to other workers
+        :param lease_timeout: seconds after which a job is sent to another
+            worker, 0 - no limit
+        """
+        self.context = context or zmq.Context.instance()
+        self.sock = self.context.socket(zmq.ROUTER)
+        self.sock.bind(address)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.lease_timeout = lease_timeout
+        # the number of jobs each live worker can take, by worker identity
+        self.credits = {}
+        # the workers that announced themselves: their host, pid and the
+        # learners they have run, by worker identity
+        self.workers = {}
+        # when each worker was last heard from
+        self.last_seen = {}
+        # the datasets workers may request, by fingerprint
+        self.datasets = {}
+        self.job_ids = itertools.count()
+        # tells results for this master from those for a previous one
+        self.session = uuid.uuid4().hex
+        self.released = False
+        # the number of jobs sent to another worker
+        self.n_requeued = 0
+
+    def send(self, worker, msg):
+        self.sock.send_multipart([worker] + dumps(msg), copy=False)
+
+    def receive(self):
+        frames = self.sock.recv_multipart(copy=False)
+        return frames[0].bytes, loads(frames[1:])
+
+    def get_workers(self):
+        """Return the live workers and what they announced about themselves
+        """
+        return {k: self.workers.get(k, {}) for k in self.credits}
+
+    def expire(self, leases, requeued):
+        """Requeue the jobs of dead workers and the jobs past their lease
+        """
+        now = time.time()
+        for worker in list(self.credits):
+            if now - self.last_seen.get(worker, now) > self.heartbeat_timeout:
+                LOGGER.info("Worker %s is not responding" % worker.decode())
+                del self.credits[worker]
+        for job_id, lease in list(leases.items()):
+            if (lease.worker not in self.credits or (
+                    self.lease_timeout and
+                    now - lease.start > self.lease_timeout)):
+                LOGGER.info("Requeueing %d configs" % len(lease.job[1]))
+                del leases[job_id]
+                requeued.append(lease.job)
+                self.n_requeued += 1
+
+    def map(self, search, chunks):
+        """Run bundles of configs on the connected workers, see
+        `executors.Executor.map`
+        """
+        # Jobs are generated when a worker has room for one, so the config
+        # space may propose configs based on the results so far
+        self.datasets = {search.key: search.data}
+        requeued = deque()
+        leases = {}
+        exhausted = False
+
+        while True:
+
+            self.expire(leases, requeued)
+
+            # Keep the prefetch queue of every worker full, so that a worker
+            # starts its next job without waiting for the master
+            for worker in self.credits:
+                while self.credits[worker] > 0:
+                    if requeued:
+                        job = requeued.popleft()
+                    else:
+                        chunk = None if exhausted else next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        job = [search.key, chunk, 'val']
+                    job_id = next(self.job_ids)
+                    leases[job_id] = Lease(worker, job)
+                    LOGGER.debug("sending %d configs" % len(job[1]))
+                    # the best validation RMSE so far, for racing
+                    self.send(worker, {"msg": "job", "job_id": job_id,
+                                       "session": self.session,
+                                       "data": job + [
+                                           search.incumbent.value]})
+                    self.credits[worker] -= 1
+            if exhausted and not requeued and not leases:
+                break
+
+            if not self.sock.poll(POLL_INTERVAL):
+                continue
+            sender, response = self.receive()
+            worker = response.get('worker', sender)
+            self.last_seen[worker] = time.time()
+
+            # A worker connects, with room for `prefetch` jobs, less the
+            # jobs already sent to it.
+            if response['msg'] == "ready":
+                n_leased = sum(1 for x in leases.values()
+                               if x.worker == worker)
+                self.credits[worker] = response['prefetch'] - n_leased
+                if worker not in self.workers:
+                    LOGGER.info("Worker %s connected, %d available" % (
+                        worker.decode(), len(self.credits)))
+                self.workers[worker] = response.get('info', {})
+
+            # A worker is alive. One that this master has not heard from, or
+            # has given up on, is told to drop its jobs and announce itself.
+            elif response['msg'] == "heartbeat":
+                if worker not in self.credits:
+                    self.send(worker, {"msg": "reset"})
+
+            # A worker returns the results of a job.
+            elif response['msg'] == "result":
+                if response.get('session') != self.session:
+                    # the job was sent by a previous master
+                    continue
+                # a worker given up on, see `expire`, gets no more jobs
+                # until it announces itself again
+                if worker in self.credits:
+                    self.credits[worker] += 1
+                if leases.pop(response['job_id'], None) is None:
+                    # the job was requeued, and this result came late
+                    continue
+                yield response['results']
+
+            # A worker asks for the dataset of its job.
+            elif response['msg'] == "data":
+                if response['key'] not in self.datasets:
+                    # the job was sent by a previous master
+                    continue
+                LOGGER.debug("sending dataset %s" % response['key'])
+                self.send(worker, {"msg": "data", "key": response['key'],
+                                   "data": self.datasets[response['key']]})
+
+    def release_workers(self, timeout=5000, shutdown=False):
+        """Tell the workers to quit, then any worker that is heard from within
+        `timeout` ms; persistent workers wait for the next master instead
+        :param shutdown: tell persistent workers to quit as well
+        """
+        self.released = True
+        quit = {"msg": "quit", "shutdown": shutdown}
+        released = set(self.credits)
+        for worker in released:
+            self.send(worker, quit)
+        self.credits.clear()
+        # workers keep sending heartbeats until they quit, and persistent
+        # workers do not quit, so wait for `timeout` after the last worker
+        # that was not told yet
+        deadline = time.time() + timeout / 1000.
+        while self.sock.poll(max(0, deadline - time.time()) * 1000):
+            sender, msg = self.receive()
+            worker = msg.get('worker', sender)
+            if worker not in released:
+                self.send(worker, quit)
+                released.add(worker)
+                deadline = time.time() + timeout / 1000.
+
+    def close(self):
+        if not self.released:
+            self.release_workers()
+        self.sock.close(linger=0)
+
+
+def send_heartbeats(context, address, worker_id, interval, stop):
+    """Tell the master that the worker is alive every `interval` seconds,
+    from a separate socket, as sockets cannot be shared between threads
+    """
+    sock = context.socket(zmq.DEALER)
+    sock.connect(address)
+    while not stop.wait(interval):
+        sock.send_multipart(dumps({"msg": "heartbeat", "worker": worker_id}))
+    sock.close(linger=0)
+
+
+def work(address, worker_id, prefetch=2, heartbeat_interval=1.,
+         context=None, run=utils.run_config, max_datasets=2, slim=False,
+         persistent=False):
+    """Run jobs from the master until it says to quit
+    :param worker_id: a unique identity of the worker, bytes
+    :param prefetch: the number of jobs to keep queued at the worker
+    :param run: the function to run a config with, `utils.run_config`
+    :param max_datasets: the number of datasets to keep
+    :param slim: leave out the in-sample forecasts of results that do not
+        beat the incumbent of their job
+    :param persistent: when the master quits, wait for the next master
+        instead of returning
+    """
+    context = context or zmq.Context.instance()
+    sock = context.socket(zmq.DEALER)
+    sock.identity = worker_id
+    sock.connect(address)
+
+    def send(msg):
+        sock.send_multipart(dumps(msg), copy=False)
+
+    stop = threading.Event()
+    heartbeats = threading.Thread(target=send_heartbeats, daemon=True,
+                                  args=(context, address, worker_id,
+                                        heartbeat_interval, stop))
+    heartbeats.start()
+
+    datasets = Datasets(max_datasets)
+    jobs = deque()
+    # the learners run so far, announced to the master
+    learners = set()
+    # incremented when the queued jobs are dropped
+    n_resets = [0]
+
+    def ready():
+        send({"msg": "ready", "prefetch": prefetch,
+              "info": {"host": socket.gethostname(), "pid": os.getpid(),
+                       "learners": sorted(learners)}})
+
+    def reset():
+        jobs.clear()
+        n_resets[0] += 1
+
+    def receive():
+        """Queue a job or store a dataset, return False on a quit message
+        """
+        msg = loads(sock.recv_multipart(copy=False))
+        if msg["msg"] == "quit":
+            if not persistent or msg.get("shutdown"):
+                return False
+            LOGGER.debug("%s: Waiting for the next master" %
+                         worker_id.decode())
+            reset()
+        elif msg["msg"] == "reset":
+            reset()
+            ready()
+        elif msg["msg"] == "job":
+            jobs.append((msg["job_id"], msg["session"], msg["data"]))
+        elif msg["msg"] == "data":
+            datasets.put(msg["key"], msg["data"])
+        return True
+
+    try:
+        ready()
+        LOGGER.debug("%s: Available" % worker_id.decode())
+        while True:
+            # wait for a job, and take all queued messages
+            while not jobs or sock.poll(0):
+                if not receive():
+                    LOGGER.debug("%s: Received a quit msg, exiting" %
+                                 worker_id.decode())
+                    return
+            job_id, session, (key, configs, mode, incumbent) = jobs.popleft()
+            if key not in datasets:
+                send({"msg": "data", "key": key})
+                n = n_resets[0]
+                while key not in datasets and n_resets[0] == n:
+                    if not receive():
+                        return
+                if key not in datasets:
+                    # the master that sent the job is gone
+                    continue
+            learners.update(c.__class__.__name__ for c in configs)
+
+            LOGGER.debug("%s: Running %d configs" % (worker_id.decode(),
+                                                     len(configs)))
+            results = utils.run_bundle([datasets.get(key), configs, mode,
+                                        incumbent], run=run)
+            if slim:
+                # the best config beats the incumbent of its job
+                results = [x if utils.is_candidate(x) and
+                           x.test_mse <= incumbent else utils.slim_result(x)
+                           for x in results]
+            send({"msg": "result", "job_id": job_id, "session": session,
+                  "results": results})
+    finally:
+        stop.set()
+        heartbeats.join()
+        sock.close()